@@ -1,4 +1,4 @@
-from sizeroyale.main import main
+from sizeroyale.cli import main
 
 if __name__ == "__main__":
     main()
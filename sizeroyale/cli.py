@@ -0,0 +1,78 @@
+import argparse
+import time
+
+
+def positive_int(s: str) -> int:
+    n = int(s)
+    if n < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, not {n}")
+    return n
+
+
+def simulate(args):
+    from sizeroyale.lib.classes.game import Game
+
+    game = Game(args.spec, seed = args.seed, headless = True)
+    seed = game.seed
+    start = time.perf_counter()
+    for n in range(args.games):
+        if n > 0:
+            game.reset(f"{seed}-{n}")
+        transcript = game.simulate()
+        if not args.quiet:
+            print(f"=== Game {game.seed!r} ===")
+            print("\n".join(transcript))
+        print(f"Winner ({game.seed!r}): {game.winner}")
+    elapsed = time.perf_counter() - start
+    if args.games > 1:
+        print(f"Simulated {args.games} games in {elapsed:.2f}s ({args.games / elapsed:.0f} games/s).")
+
+
+def montecarlo(args):
+    from sizeroyale.lib import montecarlo
+
+    if args.seeds_file:
+        with open(args.seeds_file) as f:
+            seeds = [line.strip() for line in f if line.strip()]
+    else:
+        seeds = [f"{args.seed}-{n}" for n in range(args.games)]
+    start = time.perf_counter()
+    results = montecarlo.run(args.spec, seeds, workers = args.workers)
+    elapsed = time.perf_counter() - start
+    print(results.report())
+    print(f"Ran {results.count} games in {elapsed:.2f}s ({results.count / elapsed:.0f} games/s).")
+
+
+def window(args):
+    from sizeroyale.main import main
+    main()
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(prog = "sizeroyale", description = "A Hunger-Games style size-based \"game.\"")
+    subparsers = parser.add_subparsers()
+
+    simulate_parser = subparsers.add_parser("simulate", help = "Run games with no window, images or logging, and print the results.")
+    simulate_parser.add_argument("spec", help = "The path to a royale spec file.")
+    simulate_parser.add_argument("--seed", help = "The seed of the (first) game. Random if not given.")
+    simulate_parser.add_argument("--games", type = positive_int, default = 1,
+                                 help = "How many games to run. Game n (after the first) uses the seed \"<seed>-n\".")
+    simulate_parser.add_argument("-q", "--quiet", action = "store_true", help = "Only print the winners, not the transcripts.")
+    simulate_parser.set_defaults(func = simulate)
+
+    montecarlo_parser = subparsers.add_parser("montecarlo", help = "Run many games across all cores, and print win rates and other stats.")
+    montecarlo_parser.add_argument("spec", help = "The path to a royale spec file.")
+    montecarlo_parser.add_argument("--games", type = positive_int, default = 1000, help = "How many games to run.")
+    montecarlo_parser.add_argument("--seed", default = "montecarlo", help = "Game n uses the seed \"<seed>-n\".")
+    montecarlo_parser.add_argument("--seeds-file", help = "A file with one seed per line, to use instead of --games and --seed.")
+    montecarlo_parser.add_argument("--workers", type = int, help = "How many processes to use. Defaults to one per core.")
+    montecarlo_parser.set_defaults(func = montecarlo)
+
+    args = parser.parse_args(argv)
+    if not hasattr(args, "func"):
+        args.func = window
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
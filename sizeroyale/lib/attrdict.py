@@ -28,6 +28,13 @@ class AttrDict:
             raise KeyError(f"{key!r} is a reserved key for {self.__class__.__name__!r}")
         self._values[key] = value
 
+    def __getstate__(self):
+        return self._values
+
+    def __setstate__(self, state):
+        # Without this, unpickling looks up __setstate__ through __getattr__ before _values exists.
+        super().__setattr__("_values", state)
+
     def __str__(self):
         return repr(self)
 
@@ -0,0 +1,12 @@
+import os
+from pathlib import Path
+
+
+def cache_dir(*parts) -> Path:
+    """Get (and create) a directory to cache data in between runs.
+    Defaults to ~/.cache/sizeroyale, and can be moved with $SIZEROYALE_CACHE_DIR."""
+    root = os.environ.get("SIZEROYALE_CACHE_DIR")
+    path = Path(root) if root else Path.home() / ".cache" / "sizeroyale"
+    path = path.joinpath(*parts)
+    path.mkdir(parents = True, exist_ok = True)
+    return path
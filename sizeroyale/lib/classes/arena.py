@@ -1,8 +1,8 @@
 class Arena:
-    def __init__(self, name: str, description: str, *, events: list = []):
+    def __init__(self, name: str, description: str, *, events: list = None):
         self.name = name
         self.description = description
-        self.events = events
+        self.events = [] if events is None else events
 
     def add_event(self, e):
         self.events.append(e)
@@ -1,10 +1,15 @@
 from decimal import Decimal
+from sys import intern
+from typing import Mapping
 
 from sizeroyale.lib.classes.player import Player
 from sizeroyale.lib.units import SV
 
 
 class DummyPlayer:
+    __slots__ = ["lessthan", "greaterthan", "elimslessthan", "elimsgreaterthan", "elimsequal",
+                 "team", "items", "attributes", "gender"]
+
     def __init__(self, *, lessthan: str = None, greaterthan: str = None,
                  elimslessthan: str = None, elimsgreaterthan: str = None, elimsequal: str = None,
                  team: str = None, items: list = None, gender: str = None,
@@ -14,14 +19,14 @@ class DummyPlayer:
         self.elimslessthan = None if elimslessthan is None else Decimal(elimslessthan)
         self.elimsgreaterthan = None if elimsgreaterthan is None else Decimal(elimsgreaterthan)
         self.elimsequal = None if elimsequal is None else Decimal(elimsequal)
-        self.team = team
-        self.items = items
-        self.attributes = attributes
-        self.gender = gender
-
-        self.realteam = None
+        # Team letters, genders, items and attributes repeat across a whole spec, so they're interned.
+        self.team = None if team is None else intern(team)
+        self.items = None if items is None else tuple(intern(i) for i in items)
+        self.attributes = None if attributes is None else tuple(intern(a) for a in attributes)
+        self.gender = None if gender is None else intern(gender)
 
-    def matches(self, player: Player) -> bool:
+    def matches(self, player: Player, teams: Mapping[str, str] = None) -> bool:
+        """Whether a player fits this dummy, where `teams` gives the real team for each team letter, if it's known yet."""
         if not (self.lessthan is None or player.height <= self.lessthan):
             return False
         if not (self.greaterthan is None or player.height >= self.greaterthan):
@@ -30,7 +35,7 @@ class DummyPlayer:
             return False
         if not (self.elimsgreaterthan is None or player.elims > self.elimsgreaterthan):
             return False
-        if not (self.elimsgreaterthan is None or player.elims == self.elimsgreaterthan):
+        if not (self.elimsequal is None or player.elims == self.elimsequal):
             return False
         if not (self.gender is None or self.gender in player.gender):
             return False
@@ -38,7 +43,7 @@ class DummyPlayer:
             return False
         if not (self.attributes is None or all(attribute in player.attributes for attribute in self.attributes)):
             return False
-        if not (self.realteam is None or self.realteam == player.team):
+        if not (teams is None or self.team not in teams or teams[self.team] == player.team):
             return False
 
         return True
@@ -60,6 +65,4 @@ class DummyPlayer:
             reprstring += f"team={self.team!r}, "
         if self.attributes is not None:
             reprstring += f"attributes={self.attributes!r}, "
-        if self.realteam is not None:
-            reprstring += f"realteam={self.realteam!r}, "
         return reprstring.rstrip().removesuffix(",") + ")"
@@ -1,45 +1,75 @@
+import logging
 import re
 from decimal import Decimal
-from typing import Dict
+from functools import lru_cache
+from sys import intern
+from typing import Dict, Mapping, Optional
 
+from sizeroyale.lib.attrdict import AttrDict
 from sizeroyale.lib.errors import OutOfPlayersError, ParseError
 from sizeroyale.lib.listdict import ListDict
 from sizeroyale.lib.units import Diff, SV
 from sizeroyale.lib.classes.dummyplayer import DummyPlayer
 from sizeroyale.lib.classes.metaparser import MetaParser
 from sizeroyale.lib.classes.player import Player
+from sizeroyale.lib.classes.playerpool import PlayerPool
+from sizeroyale.lib.classes.requirements import Requirements
 
 re_format = r"%(\d.*?)%"
 re_team = r"[A-Z]"
 re_gender = r"[MFX]"
-re_pronoun_weak = r"%[pP]:.*?%"
 re_pronoun = r"^([pP]):(\d)(|o|s|self)$"
+# A player tag (%1%, %2<1ft%...) or a pronoun tag (%p:1%, %P:2self%...)
+re_template = re.compile(r"%(?:(\d)[^%]*|([pP]:[^%]*))%")
+
+pronoun_kinds = {"": "subject", "o": "object", "s": "posessive", "self": "reflexive"}
+
+# How many ways of giving team letters to real teams an event tries before it gives up.
+MAX_TEAM_ASSIGNMENTS = 32
+
+logger = logging.getLogger("sizeroyale")
+
+# Tribute counts are repeated all over a spec, so events share one copy of each.
+shared_decimal = lru_cache(maxsize = 256)(Decimal)
 
 
 class Event:
     valid_data = [("tributes", "single"), ("size", "compound"), ("setsize", "compound"),
                   ("elim", "list"), ("perp", "list"), ("give", "compound"), ("remove", "compound"),
                   ("giveattr", "compound"), ("removeattr", "compound"), ("clear", "list"), ("rarity", "single")]
+    # Specs can have tens of thousands of events, so they're slotted, and their fields are tuples.
+    __slots__ = ["_original_metadata", "_metadata", "text", "tributes", "sizes", "setsizes", "elims", "perps",
+                 "gives", "removes", "giveattrs", "removeattrs", "clears", "rarity", "dummies",
+                 "_dummy_list", "_team_groups", "requirements", "_template"]
 
-    def __init__(self, game, text: str, meta: str):
-        self._game = game
-        self._original_metadata = meta
-        self._metadata = MetaParser(type(self)).parse(meta)
+    def __init__(self, text: str, meta: str, *, metadata: AttrDict = None,
+                 shared_dummies: Dict[tuple, DummyPlayer] = None):
+        # The parser passes in the metadata it already parsed,
+        # and a dict that the events of one spec share identical DummyPlayers through.
+        if metadata is None:
+            metadata = MetaParser(type(self)).parse(meta)
+        # Everything in the metadata ends up in the fields below, so it's only kept for debugging.
+        if logger.isEnabledFor(logging.DEBUG):
+            self._original_metadata = meta
+            self._metadata = metadata
+        else:
+            self._original_metadata = None
+            self._metadata = None
         self.text = text
-        self.tributes = None if self._metadata.tributes is None else Decimal(self._metadata.tributes)
-        self.sizes = None if self._metadata.size is None else [(int(k), Diff.parse(v)) for k, v in self._metadata.size]
-        self.setsizes = None if self._metadata.setsize is None else [(int(k), SV.parse(v)) for k, v in self._metadata.setsize]
-        self.elims = None if self._metadata.elim is None else [int(i) for i in self._metadata.elim]
-        self.perps = None if self._metadata.perp is None else [int(i) for i in self._metadata.perp]
-        self.gives = None if self._metadata.give is None else [(int(k), v) for k, v in self._metadata.give]
-        self.removes = None if self._metadata.remove is None else [(int(k), v) for k, v in self._metadata.remove]
-        self.giveattrs = None if self._metadata.giveattr is None else [(int(k), v) for k, v in self._metadata.giveattr]
-        self.removeattrs = None if self._metadata.removeattr is None else [(int(k), v) for k, v in self._metadata.removeattr]
-        self.clears = None if self._metadata.clear is None else [int(i) for i in self._metadata.clear]
-        self.rarity = 1 if self._metadata.rarity is None else float(self._metadata.rarity)
+        self.tributes = None if metadata.tributes is None else shared_decimal(metadata.tributes)
+        self.sizes = None if metadata.size is None else tuple((int(k), Diff.parse(v)) for k, v in metadata.size)
+        self.setsizes = None if metadata.setsize is None else tuple((int(k), SV.parse(v)) for k, v in metadata.setsize)
+        self.elims = None if metadata.elim is None else tuple(int(i) for i in metadata.elim)
+        self.perps = None if metadata.perp is None else tuple(int(i) for i in metadata.perp)
+        self.gives = None if metadata.give is None else tuple((int(k), intern(v)) for k, v in metadata.give)
+        self.removes = None if metadata.remove is None else tuple((int(k), intern(v)) for k, v in metadata.remove)
+        self.giveattrs = None if metadata.giveattr is None else tuple((int(k), intern(v)) for k, v in metadata.giveattr)
+        self.removeattrs = None if metadata.removeattr is None else tuple((int(k), intern(v)) for k, v in metadata.removeattr)
+        self.clears = None if metadata.clear is None else tuple(int(i) for i in metadata.clear)
+        self.rarity = 1 if metadata.rarity is None else float(metadata.rarity)
         self.dummies = {}
 
-        self.parse(self.text)
+        self.parse(self.text, shared_dummies)
 
         if self.tributes is None:
             raise ParseError("Tribute amount not defined.")
@@ -47,7 +77,14 @@ class Event:
         if self.tributes != len(self.dummies):
             raise ParseError(f"Tribute amount mismatch. ({self.tributes} != {len(self.dummies)})")
 
-    def parse(self, s: str):
+        self._dummy_list = tuple(self.dummies.values())
+        # The dummies that share each team letter.
+        letters = dict.fromkeys(d.team for d in self._dummy_list if d.team)
+        self._team_groups = tuple(tuple(d for d in self._dummy_list if d.team == letter) for letter in letters)
+        self.requirements = Requirements(self._dummy_list)
+        self._template = self._compile(self.text)
+
+    def parse(self, s: str, shared_dummies: Dict[tuple, DummyPlayer] = None):
         """Fill in the properties of the Event."""
         formats = re.findall(re_format, s)
 
@@ -118,88 +155,105 @@ class Event:
                 else:
                     ParseError(f"Invalid format tag: {f}")
 
-            self.dummies[int(pid)] = DummyPlayer(lessthan = lessthan,
-                                                 greaterthan = greaterthan,
-                                                 elimslessthan = elimslessthan,
-                                                 elimsgreaterthan = elimsgreaterthan,
-                                                 elimsequal = elimsequal,
-                                                 team = team,
-                                                 items = items if items else None,
-                                                 gender = gender,
-                                                 attributes = attributes if attributes else None)
-
-    def get_players(self, playerpool: Dict[str, Player]) -> ListDict[str, Player]:
-        """ Get an ordered dictionary of players that match the DummyPlayers
-        assigned to this event from a pool of players passed in."""
-        playerpool = [v for v in playerpool.values()]
-        self._game.random.shuffle(playerpool)
+            tag = (lessthan, greaterthan, elimslessthan, elimsgreaterthan, elimsequal,
+                   team, tuple(items) if items else None, gender, tuple(attributes) if attributes else None)
+            dummy = None if shared_dummies is None else shared_dummies.get(tag)
+            if dummy is None:
+                dummy = DummyPlayer(lessthan = lessthan,
+                                    greaterthan = greaterthan,
+                                    elimslessthan = elimslessthan,
+                                    elimsgreaterthan = elimsgreaterthan,
+                                    elimsequal = elimsequal,
+                                    team = team,
+                                    items = tag[6],
+                                    gender = gender,
+                                    attributes = tag[8])
+                if shared_dummies is not None:
+                    shared_dummies[tag] = dummy
+            self.dummies[int(pid)] = dummy
 
-        good_players = []
+    def get_players(self, playerpool: Mapping[str, Player], rng) -> ListDict[str, Player]:
+        """ Get an ordered dictionary of players that match the DummyPlayers
+        assigned to this event from a pool of players passed in, choosing with rng.
+        Raises OutOfPlayersError if there's no way to assign them."""
+        if not isinstance(playerpool, PlayerPool):
+            playerpool = PlayerPool(playerpool)
 
-        if len(playerpool) < len(self.dummies):
+        # Rule out hopeless events before doing any matching.
+        if not playerpool.might_fit(self.requirements):
             raise OutOfPlayersError
 
-        # Assign dummy teams to real teams.
-        teams = set()
-        teammap = {}
-        for player in playerpool:
-            teams.add(player.team)
-        for d in self.dummies.values():
-            if d.team:
-                if d.team in teammap:
-                    d.realteam = teammap[d.team]
-                else:
-                    randomteam = self._game.random.choice(list(teams))
-                    teammap[d.team] = randomteam
-                    d.realteam = teammap[d.team]
-                    teams.remove(randomteam)
-
-        # Assign dummy players to real players.
-        for d in self.dummies.values():
-            for n, p in enumerate(playerpool):
-                if d.matches(p):
-                    good_players.append(playerpool.pop(n))
-                    break
-
-        if len(good_players) != len(self.dummies):
+        if self._team_groups:
+            players = self._assign_teams(playerpool, rng)
+        else:
+            players = playerpool.match(self._dummy_list, rng)
+        if players is None:
             raise OutOfPlayersError
 
-        return ListDict({p.name: p for p in good_players})
+        return ListDict(players)
+
+    def _assign_teams(self, playerpool: PlayerPool, rng) -> Optional[Dict[str, Player]]:
+        """Give each team letter a different real team, backtracking until every dummy can be matched."""
+        tries = MAX_TEAM_ASSIGNMENTS
+
+        def assign(n: int, assigned: Dict[str, str]) -> Optional[Dict[str, Player]]:
+            nonlocal tries
+            if n == len(self._team_groups):
+                tries -= 1
+                return playerpool.match(self._dummy_list, rng, assigned)
+            group = self._team_groups[n]
+            teams = playerpool.teams
+            first = True
+            while teams and tries > 0:
+                team = teams.pop(rng.randrange(len(teams)))
+                if team in assigned.values() or playerpool.team_size(team) < len(group):
+                    continue
+                letters = {**assigned, group[0].team: team}
+                # The first team usually works, so only check the rest can fill this letter on their own.
+                if not first and playerpool.match(group, rng, letters) is None:
+                    continue
+                first = False
+                if (players := assign(n + 1, letters)) is not None:
+                    return players
+            return None
+
+        return assign(0, {})
+
+    def _compile(self, s: str) -> tuple:
+        """Split the event text into literal strings and (player index, pronoun kind, capitalized)
+        slots, where a pronoun kind of None means the player's name."""
+        template = []
+        last = 0
+        for match in re_template.finditer(s):
+            if match.start() > last:
+                template.append(s[last:match.start()])
+            last = match.end()
+            if match.group(1) is not None:
+                template.append((int(match.group(1)) - 1, None, False))
+                continue
+            if not (pronoun := re.match(re_pronoun, match.group(2))):
+                raise ParseError(f"Pronoun string {match.group(0)!r} in incorrect format.", column = match.start() + 1)
+            pid = int(pronoun.group(2))
+            if not 1 <= pid <= len(self.dummies):
+                raise ParseError(f"Pronoun string {match.group(0)!r} refers to a player not in this event.", column = match.start() + 1)
+            template.append((pid - 1, pronoun_kinds[pronoun.group(3)], pronoun.group(1) == "P"))
+        if last < len(s):
+            template.append(s[last:])
+        return tuple(template)
 
     def fillin(self, players: ListDict[str, Player]) -> str:
         """Generates a string representing what happens in this event using an
         ordered list of players as fill-ins."""
-        out = self.text
-        for i in range(len(players)):
-            subsstring = "%" + str(i + 1) + ".*?%"
-            out = re.sub(subsstring, players.getByIndex(i).name, out)
-        while (search := re.search(re_pronoun_weak, out)):
-            replacestring = search.group(0)
-            out = out.replace(replacestring, self._pronoun_parse(players, replacestring))
-
-        return out
-
-    def _pronoun_parse(self, players: ListDict[str, Player], s: str) -> str:
-        """Gets the correct pronoun from a ordered dict of players and a pronoun format string."""
-        if not s.startswith("%") and s.endswith("%"):
-            raise ParseError("Pronoun string does not start and end with %.")
-        s = s[1:-1]
-        if (match := re.match(re_pronoun, s)):
-            capital = True if match.group(1) == "P" else False
-            pid = int(match.group(2))
-            player = players.getByIndex(pid - 1)
-            if match.group(3) == "":
-                return player.subject.capitalize() if capital else player.subject
-            elif match.group(3) == "o":
-                return player.object.capitalize() if capital else player.object
-            elif match.group(3) == "s":
-                return player.posessive.capitalize() if capital else player.posessive
-            elif match.group(3) == "self":
-                return player.reflexive.capitalize() if capital else player.reflexive
-            else:
-                raise ParseError(f"Invalid pronoun type '{match.group(3)}'")
-        else:
-            raise ParseError("Pronoun string in incorrect format.")
+        players = list(players.values())
+        out = []
+        for token in self._template:
+            if isinstance(token, str):
+                out.append(token)
+                continue
+            i, kind, capital = token
+            word = players[i].name if kind is None else players[i].pronouns[kind]
+            out.append(word.capitalize() if capital else word)
+        return "".join(out)
 
     def __str__(self):
         return repr(self)
@@ -0,0 +1,43 @@
+from typing import Optional
+
+from PIL import Image
+
+from sizeroyale.lib.img_utils import LazyImage
+
+
+class EventRecord:
+    """What happened in one event (or one round of cannon shots.)
+    The image is only drawn the first time it's asked for.
+    `kind` is "event", "cannon", or one of the "round" and "gameover" markers Game.iter_events() gives."""
+    def __init__(self, text: str, image: Optional[LazyImage] = None, *, players: dict = None, deaths: list = None,
+                 kind: str = "event"):
+        self.text = text
+        self.kind = kind
+        self._image = image
+        self.players = {} if players is None else players
+        self.deaths = [] if deaths is None else deaths
+
+    @property
+    def image(self) -> Optional[Image.Image]:
+        if self._image is None:
+            return None
+        return self._image.render()
+
+    def __iter__(self):
+        """Allows `text, image = record`, like the tuples this replaced."""
+        yield self.text
+        yield self.image
+
+    def __getitem__(self, index: int):
+        """Allows record[0] and record[1], like the tuples this replaced."""
+        if index in (0, -2):
+            return self.text
+        if index in (1, -1):
+            return self.image
+        raise IndexError("EventRecord index out of range")
+
+    def __str__(self):
+        return self.text
+
+    def __repr__(self):
+        return f"EventRecord(kind={self.kind!r}, text={self.text!r}, image={self._image!r})"
@@ -0,0 +1,115 @@
+from typing import Dict, Iterable, List, Optional
+
+from sizeroyale.lib.classes.event import Event
+
+
+class EventSampler:
+    """
+    Draws events at random, weighted by their rarity, from a Fenwick tree of the weights,
+    so each draw takes O(log n) instead of rebuilding the weights every time.
+    Events can be excluded from the draws until restore() is called.
+    """
+    def __init__(self, events: Iterable[Event] = ()):
+        self.events: List[Event] = []
+        self._weights: List[float] = []
+        self._index: Dict[Event, int] = {}
+        self._excluded: List[int] = []
+        # 1-indexed: _tree[i] is the total weight of the events in (i - lowbit(i), i].
+        self._tree: List[float] = [0.0]
+        self._live = 0
+        for e in events:
+            self.add(e)
+
+    def add(self, event: Event):
+        """Add an event, in O(log n)."""
+        weight = float(event.rarity)
+        self._index[event] = len(self.events)
+        self.events.append(event)
+        self._weights.append(weight)
+        i = len(self.events)
+        children = []
+        j = i - 1
+        stop = i - (i & -i)
+        while j > stop:
+            children.append(self._tree[j])
+            j -= j & -j
+        # Sum in the same order restore() does, so the tree comes out exactly the same either way.
+        value = weight
+        for child in reversed(children):
+            value += child
+        self._tree.append(value)
+        if weight > 0:
+            self._live += 1
+
+    def position(self, event: Event) -> int:
+        """Where an event is in the list the sampler was made from."""
+        return self._index[event]
+
+    def _update(self, i: int, delta: float):
+        i += 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def _find(self, r: float) -> int:
+        """The index of the first event whose running total of weights is more than r."""
+        pos = 0
+        step = 1 << (len(self.events).bit_length() - 1) if self.events else 0
+        while step:
+            nxt = pos + step
+            if nxt < len(self._tree) and self._tree[nxt] <= r:
+                pos = nxt
+                r -= self._tree[nxt]
+            step >>= 1
+        return min(pos, len(self.events) - 1)
+
+    @property
+    def total(self) -> float:
+        """The total weight of the events that can be drawn."""
+        total = 0.0
+        i = len(self.events)
+        while i:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def draw(self, rng) -> Optional[Event]:
+        """Draw an event that isn't excluded, or None if there aren't any left."""
+        while self._live:
+            i = self._find(rng.random() * self.total)
+            # Rounding can leave a sliver of weight behind for an excluded event.
+            if self._weights[i] > 0:
+                return self.events[i]
+        return None
+
+    def exclude(self, event: Event):
+        """Stop drawing an event until restore() is called."""
+        i = self._index[event]
+        weight = self._weights[i]
+        if weight <= 0:
+            return
+        self._weights[i] = 0.0
+        self._excluded.append(i)
+        self._live -= 1
+        self._update(i, -weight)
+
+    def restore(self):
+        """Put every excluded event back."""
+        if not self._excluded:
+            return
+        for i in self._excluded:
+            self._weights[i] = float(self.events[i].rarity)
+            self._live += 1
+        self._excluded = []
+        # Rebuild the tree in O(n) so that rounding errors don't pile up over a game.
+        self._tree = [0.0] + self._weights
+        for i in range(1, len(self._tree)):
+            parent = i + (i & -i)
+            if parent < len(self._tree):
+                self._tree[parent] += self._tree[i]
+
+    def __len__(self):
+        return len(self.events)
+
+    def __repr__(self):
+        return f"EventSampler(events={len(self.events)}, excluded={len(self._excluded)})"
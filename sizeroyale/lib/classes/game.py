@@ -1,30 +1,45 @@
 import logging
 import random
-from copy import copy
+from typing import Generator, Iterator, List, Optional, Union
 
 from sizeroyale.lib import petname
-from sizeroyale.lib.img_utils import merge_images
+from sizeroyale.lib.img_utils import LazyImage, create_cards_image, prefetch_images
 from sizeroyale.lib.loglevels import ROYALE
+from sizeroyale.lib.classes.eventrecord import EventRecord
+from sizeroyale.lib.classes.playerpool import PlayerPool
 from sizeroyale.lib.classes.royale import Royale
-from sizeroyale.lib.errors import OutOfEventsError, OutOfPlayersError, ThisShouldNeverHappenException
+from sizeroyale.lib.classes.snapshot import GameSnapshot
+from sizeroyale.lib.errors import GametimeError, OutOfEventsError, OutOfPlayersError, ThisShouldNeverHappenException
 
 logger = logging.getLogger("sizeroyale")
 
 
 class Game:
-    def __init__(self, filepath, *, seed = None):
+    def __init__(self, filepath, *, seed = None, prefetch = True, headless = False, replay = None):
+        # Headless games run the same simulation, but don't draw, format or log anything.
+        self.headless = headless
+        # A ReplayWriter to log every round to, if any.
+        self.replay = replay
         self.royale = Royale(filepath, self)
-        if self.royale.parser.errors:
-            for e in self.royale.parser.errors:
+        if self.royale.spec.errors:
+            for e in self.royale.spec.errors:
                 logger.error(e)
 
+        if prefetch and not headless:
+            prefetch_images(p.url for p in self.royale.players.values())
+
+        self.random = random.Random()
+        self._last_snapshot = None
+        # The samplers that have had events excluded this round.
+        self._excluding = set()
+        self._start(seed)
+
+    def _start(self, seed):
         if seed is None:
             self.seed = petname.generate(3, letters = 10)
         else:
             self.seed = seed
 
-        self.random = random.Random()
-
         self.random.seed(self.seed)
 
         self.current_day = 0
@@ -33,6 +48,78 @@ class Game:
         self.running_arena = False
         self.feasted = False
         self.unreported_deaths = []
+        if self.replay is not None:
+            self.replay.start(self)
+
+    def reset(self, seed = None):
+        """Start a new game from the same spec, without parsing it again."""
+        self.royale.reset()
+        self._start(seed)
+
+    def snapshot(self) -> GameSnapshot:
+        """Capture the state of the game as it is now, to restore() later, here or in another game of the same spec."""
+        last = self._last_snapshot
+        players = {}
+        for name, p in self.royale.players.items():
+            state = p.snapshot()
+            # Keep the last snapshot's copy if nothing changed, so unchanged players only cost one reference.
+            if last is not None and last.players.get(name) == state:
+                state = last.players[name]
+            players[name] = state
+        snapshot = GameSnapshot(
+            players = players,
+            seed = self.seed,
+            random_state = self.random.getstate(),
+            current_day = self.current_day,
+            current_event_type = self.current_event_type,
+            current_arena = None if self.current_arena is None else self.royale.arenas.index(self.current_arena),
+            running_arena = self.running_arena,
+            feasted = self.feasted,
+            unreported_deaths = tuple(p.name for p in self.unreported_deaths)
+        )
+        self._last_snapshot = snapshot
+        return snapshot
+
+    def restore(self, snapshot: GameSnapshot):
+        """Put the game back the way it was when a snapshot was taken."""
+        if snapshot.players.keys() != self.royale.players.keys():
+            raise GametimeError("This snapshot is from a game with different players.")
+        self.royale.restore(snapshot.players)
+        self.royale.restore_events()
+        self.seed = snapshot.seed
+        self.random.setstate(snapshot.random_state)
+        self.current_day = snapshot.current_day
+        self.current_event_type = snapshot.current_event_type
+        self.current_arena = None if snapshot.current_arena is None else self.royale.arenas[snapshot.current_arena]
+        self.running_arena = snapshot.running_arena
+        self.feasted = snapshot.feasted
+        self.unreported_deaths = [self.royale.players[n] for n in snapshot.unreported_deaths]
+
+    def simulate(self) -> list:
+        """Play the game until it's over, returning the transcript."""
+        transcript = []
+        while self.game_over is None:
+            result = self.next()
+            if result is None:
+                break
+            if isinstance(result, EventRecord):
+                transcript.append(result.text)
+                continue
+            transcript.append(f"[{self.current_event_type.capitalize()}, Day {self.current_day}]")
+            transcript.extend(r.text for r in result)
+        return transcript
+
+    @property
+    def winner(self) -> str:
+        """A description of who won, for display purposes."""
+        winner = self.game_over
+        if winner is None:
+            return "Nobody yet"
+        if winner == 0:
+            return "Nobody"
+        if self.royale.teamwin:
+            return f"Team {winner}"
+        return winner[0]
 
     @property
     def cannon_time(self):
@@ -43,26 +130,81 @@ class Game:
         return self.royale.game_over
 
     def next(self):
+        """Run the next round, returning a list of EventRecords, or one EventRecord for cannon shots.
+        Images aren't drawn until a record's image is used."""
         if self.game_over:
-            logger.log(ROYALE, "This game is already completed. Please start a new game.")
-            return ("This game is already completed. Please start a new game.", None)
+            if not self.headless:
+                logger.log(ROYALE, "This game is already completed. Please start a new game.")
+            return EventRecord("This game is already completed. Please start a new game.")
         if self.cannon_time:
-            unreported_deaths = self.unreported_deaths
-            self.unreported_deaths = []
-            logger.log(ROYALE, f"[GAME] {len(unreported_deaths)} cannon shots sound through the arena.")
-            return (f"{len(unreported_deaths)} cannon shot{'' if len(unreported_deaths) == 1 else 's'} sound through the arena.",
-                    merge_images([p.image for p in unreported_deaths]))
+            return self._cannon()
         round = self._next_round()
         if round is None:
             return None
+        return [self._record(e) for e in round]
+
+    def iter_events(self) -> Iterator[EventRecord]:
+        """Play the rest of the game, yielding an EventRecord for each thing as soon as it happens:
+        a "round" marker when a round starts, each "event" as soon as it's run, each round of
+        "cannon" shots, and a "gameover" marker at the end.
+        Unlike next(), events from a round the game ends partway through are still yielded,
+        since they've already been yielded by the time the game ends."""
+        while self.game_over is None:
+            if self.cannon_time:
+                yield self._cannon()
+                continue
+            playerpool = self._start_round()
+            yield EventRecord(f"[{self.current_event_type.capitalize()}, Day {self.current_day}]", kind = "round")
+            for e in self._play_round(playerpool):
+                yield self._record(e)
+        yield self._game_over_record()
+
+    def iter_rounds(self) -> Iterator[Union[List[EventRecord], EventRecord]]:
+        """Play the rest of the game, yielding whatever next() returns each time, then a "gameover" marker."""
+        while self.game_over is None:
+            result = self.next()
+            if result is None:
+                break
+            yield result
+        yield self._game_over_record()
+
+    def _record(self, e: dict) -> EventRecord:
+        return EventRecord(e["text"], e["image"], players = e["players"], deaths = e["deaths"])
+
+    def _game_over_record(self) -> EventRecord:
+        return EventRecord(f"The game is over! Winner: {self.winner}", kind = "gameover")
+
+    def _cannon(self) -> EventRecord:
+        """Report the deaths since the last cannon shots."""
+        unreported_deaths = self.unreported_deaths
+        self.unreported_deaths = []
+        if self.replay is not None:
+            self.replay.cannon(unreported_deaths)
+        if self.headless:
+            image = None
+        else:
+            logger.log(ROYALE, f"[GAME] {len(unreported_deaths)} cannon shots sound through the arena.")
+            image = LazyImage(create_cards_image, [p.card for p in unreported_deaths], self.royale.unitsystem)
+        return EventRecord(f"{len(unreported_deaths)} cannon shot{'' if len(unreported_deaths) == 1 else 's'} sound through the arena.",
+                           image, deaths = unreported_deaths, kind = "cannon")
+
+    def _next_round(self) -> Optional[List[dict]]:
+        """Run the next round, returning every event's result, or None if the game ended partway through."""
+        round = self._play_round(self._start_round())
         events = []
-        for e in round:
-            events.append((e["text"], e["image"]))
-        return events
+        try:
+            while True:
+                events.append(next(round))
+        except StopIteration as done:
+            return events if done.value else None
 
-    def _next_round(self):
+    def _start_round(self) -> PlayerPool:
+        """Move on to the next round, returning the pool of players who'll be in it."""
         # Reset player pool.
-        playerpool = self.royale.alive_players
+        playerpool = self.royale.player_pool()
+        for sampler in self._excluding:
+            sampler.restore()
+        self._excluding.clear()
 
         # Progress the round type forward.
         if self.current_day == 0:
@@ -96,27 +238,43 @@ class Game:
             else:
                 raise ThisShouldNeverHappenException("Round type not valid.")
 
-        logger.log(ROYALE, "[ROUND] " + self.current_event_type.capitalize() + f", Day {self.current_day}")
-        events = []
+        if not self.headless:
+            logger.log(ROYALE, "[ROUND] " + self.current_event_type.capitalize() + f", Day {self.current_day}")
+        return playerpool
+
+    def _play_round(self, playerpool: PlayerPool) -> Generator[dict, None, bool]:
+        """Run events until everyone in the pool has had one, yielding each one's result as soon as it's run.
+        Returns False if the game ended partway through the round."""
+        # Only kept for the replay log, so that streaming a round doesn't hold on to it otherwise.
+        events = [] if self.replay is not None else None
         while playerpool:
-            if self.game_over:
-                logger.log(ROYALE, f"[GAME] GAME OVER! Winning Team: {self.royale.game_over}")
-                return None
+            if self.game_over is not None:
+                if not self.headless:
+                    logger.log(ROYALE, f"[GAME] GAME OVER! Winning Team: {self.royale.game_over}")
+                if self.replay is not None:
+                    self.replay.round(self, events, shown = False)
+                return False
             e = self._next_event(playerpool)
             for p in e["players"]:
                 playerpool.pop(p)
             for d in e["deaths"]:
                 self.unreported_deaths.append(d)
-            events.append(e)
+            if events is not None:
+                events.append(e)
+            yield e
         if self.running_arena:
             self.running_arena = False
-            logger.log(ROYALE, "[ARENA] Arena over!")
+            if not self.headless:
+                logger.log(ROYALE, "[ARENA] Arena over!")
 
-        return events
+        if self.replay is not None:
+            self.replay.round(self, events, shown = True)
+        return True
 
-    def _next_event(self, playerpool: dict):
+    def _next_event(self, playerpool: PlayerPool):
         if self.royale.game_over is not None:
-            logger.log(ROYALE, f"[GAME] GAME OVER! Winning Team: {self.royale.game_over}")
+            if not self.headless:
+                logger.log(ROYALE, f"[GAME] GAME OVER! Winning Team: {self.royale.game_over}")
             return
         if self.current_event_type in ["bloodbath", "feast", "arena"]:
             event_type = self.current_event_type
@@ -132,35 +290,28 @@ class Game:
             if not self.current_arena:
                 self.current_arena = self.random.choice(self.royale.arenas)
                 self.running_arena = True
-                logger.log(ROYALE, f"[ARENA] Running arena {self.current_arena.name}...")
-            trying_events = True
-            events = copy(self.current_arena.events)
-            while trying_events:
-                if not events:
-                    raise OutOfEventsError
-                event = self.random.choices(events, [e.rarity for e in events])[0]
-                try:
-                    players = event.get_players(playerpool)
-                    r = self.royale._run_event(event, players)
-                    trying_events = False
-                    return r
-                except OutOfPlayersError:
-                    events.remove(event)
-
+                if not self.headless:
+                    logger.log(ROYALE, f"[ARENA] Running arena {self.current_arena.name}...")
+            sampler = self.royale.arena_samplers[self.current_arena]
+            event_id = ["arena", self.royale.arenas.index(self.current_arena)]
         else:
-            trying_events = True
-            events = copy(getattr(self.royale.events, event_type + "_events"))
-            while trying_events:
-                if not events:
-                    raise OutOfEventsError
-                event = self.random.choices(events, [e.rarity for e in events])[0]
-                try:
-                    players = event.get_players(playerpool)
-                    r = self.royale._run_event(event, players)
-                    trying_events = False
-                    return r
-                except OutOfPlayersError:
-                    events.remove(event)
+            sampler = self.royale.event_samplers[event_type]
+            event_id = [event_type]
+
+        # The pool only shrinks during a round, so an event that can't find players now
+        # won't find them later in the round either. It stays excluded until the next round.
+        while (event := sampler.draw(self.random)) is not None:
+            try:
+                players = event.get_players(playerpool, self.random)
+            except OutOfPlayersError:
+                sampler.exclude(event)
+                self._excluding.add(sampler)
+                continue
+            result = self.royale._run_event(event, players)
+            # Which event it was, for replay logs.
+            result["event"] = event_id + [sampler.position(event)]
+            return result
+        raise OutOfEventsError
 
     def __str__(self):
         return f"Game(seed={self.seed!r}\n{str(self.royale)}\n)"
@@ -1,4 +1,4 @@
-from typing import Type
+from typing import Dict, List, Type
 
 from sizeroyale.lib.attrdict import AttrDict
 from sizeroyale.lib.errors import ParseError
@@ -17,13 +17,17 @@ class MetaParser:
     compound: allows an abitrary amount of that type of data, and returns a
     list of tuples of an abitrary length, by splitting the value by colons.
     e.g.: "a:b:c" -> {a: (b, c)} | "a:b:c:d" -> {a: (b, c, d)}
+    After parsing, `columns` has where each item started in the string, counting from 1,
+    by name and in the order they appeared.
     """
     def __init__(self, t: Type):
         self.t = t
+        self.columns: Dict[str, List[int]] = {}
 
     def parse(self, s: str) -> AttrDict:
 
         returndict = {}
+        self.columns = {}
 
         try:
             validdata = dict(self.t.valid_data)
@@ -31,18 +35,22 @@ class MetaParser:
             raise ParseError(f"Type {self.t} does not define valid metadata.")
 
         items = s.split(",")
+        offset = 0
         for item in items:
+            column = offset + len(item) - len(item.lstrip()) + 1
+            offset += len(item) + 1
             item = item.strip()
             kv = item.split(":", 1)
             try:
                 k, v = (kv[0], kv[1])
             except IndexError:
-                raise ParseError(f"Metatag {kv[0]} has no value.")
+                raise ParseError(f"Metatag {kv[0]} has no value.", column = column)
             if k in validdata:
+                self.columns.setdefault(k, []).append(column)
                 datatype = validdata[k]
                 if datatype == "single":
                     if k in returndict:
-                        raise ParseError(f"Metadata type {k} defined multiple times, but is a 'single' type data.")
+                        raise ParseError(f"Metadata type {k} defined multiple times, but is a 'single' type data.", column = column)
                     else:
                         returndict[k] = v
                 elif datatype == "list":
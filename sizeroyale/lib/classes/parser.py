@@ -1,31 +1,74 @@
 import re
+from typing import Iterable, Iterator, List, Tuple
 
-from tqdm import trange
-
-from sizeroyale.lib.errors import ParseError
+from sizeroyale.lib import units
+from sizeroyale.lib.errors import ParseError, SpecError
 from sizeroyale.lib.classes.arena import Arena
-from sizeroyale.lib.classes.event import Event
+from sizeroyale.lib.classes.event import Event, re_format
+from sizeroyale.lib.classes.metaparser import MetaParser
 from sizeroyale.lib.classes.player import Player
 from sizeroyale.lib.classes.setup import Setup
+from sizeroyale.lib.units import SV, Diff
+
+re_header = re.compile(r"\[(.*)\]")
+re_quotes = re.compile(r"\"(.*)\"")
+re_arena = re.compile(r"\<(.*)\>\s*\"(.*)\"")
+re_tag = re.compile(re_format)
+
+event_headers = ["bloodbath", "day", "night", "fatalday", "fatalnight", "feast"]
+
+# How many records to resolve units for and build at a time.
+CHUNK_SIZE = 1024
+
+record_types = {"setup": Setup, "player": Player, "event": Event, "arenaevent": Event}
 
-re_header = r"\[(.*)\]"
-re_quotes = r"\"(.*)\""
-re_arena = r"\<(.*)\>\s*\"(.*)\""
-re_digit = r"\d"
+
+class Record:
+    """One thing in a spec: its kind, its strings, and where it and its metadata line start."""
+    __slots__ = ["kind", "fields", "line", "column", "meta", "meta_line", "meta_column", "metadata", "columns"]
+
+    def __init__(self, kind: str, fields: tuple, line: int, column: int,
+                 meta: str = None, meta_line: int = None, meta_column: int = None):
+        self.kind = kind
+        self.fields = fields
+        self.line = line
+        self.column = column
+        self.meta = meta
+        self.meta_line = meta_line
+        self.meta_column = meta_column
+        # Filled in once the metadata is parsed.
+        self.metadata = None
+        self.columns = None
+
+
+def _clean_lines(lines: Iterable[str]) -> Iterator[Tuple[int, int, str]]:
+    """Yield (line number, indent, line) for every non-blank line, stripped, with smart quotes made straight."""
+    for n, raw in enumerate(lines, 1):
+        line = raw.strip()
+        # Don't bother with blank lines.
+        if not line:
+            continue
+        # F*** smart quotes.
+        line = line.replace("“", "\"").replace("”", "\"")
+        yield n, len(raw) - len(raw.lstrip()), line
 
 
 class Parser:
-    def __init__(self, game, lines: list):
+    """Parses a royale spec from any iterable of lines (a file, a list, a generator...) in one pass.
+    Records are built CHUNK_SIZE at a time, after every unit string in the chunk is resolved
+    in one batch, so only one chunk of the spec is ever held in memory.
+    Problems are collected in `errors` as SpecErrors rather than raised."""
+    def __init__(self, game, lines: Iterable[str]):
         self._game = game
-        self._lines = lines
-        self.original_line_numbers = {}
-        self.errors = []
+        self.errors: List[SpecError] = []
 
         self.minsize = None
         self.maxsize = None
         self.autoelim = None
         self.teamwin = None
         self.deathrate = None
+        self.arenafreq = None
+        self.unitsystem = None
         self.players = {}
         self.arenas = []
         self.bloodbath_events = []
@@ -35,77 +78,145 @@ class Parser:
         self.fatalnight_events = []
         self.feast_events = []
 
-        self._current_header = None
         self._current_arena = None
-        self._current_line = None
-        self._skip_next_line = False
-
-        # Setup
-        self._clean_lines()
-        self.parse()
-
-    def parse(self):
-        if not self.lines:
+        self._empty = True
+        # Identical player tags across this spec's events share one DummyPlayer.
+        self._dummies = {}
+
+        self.parse(lines)
+
+    def parse(self, lines: Iterable[str]):
+        chunk = []
+        for record in self._read_records(lines):
+            chunk.append(record)
+            if len(chunk) >= CHUNK_SIZE:
+                self._build(chunk)
+                chunk = []
+        self._build(chunk)
+        if self._empty:
             raise ParseError("No lines to parse!")
-        for n in trange(len(self.lines), desc="Parsing..."):
-            try:
-                self._parse_line(n)
-            except ParseError as e:
-                self.errors.append(f"Line {self.original_line_numbers[n]}: " + e.message)
         # If there is still a arena in the queue, add it.
-        if self.arenas is not None:
+        if self._current_arena is not None:
             self.arenas.append(self._current_arena)
         self._current_arena = None
-
-    def _clean_lines(self):
-        fixed_lines = []
-        cln = 0
-
-        for line in self._lines:
-            # No newlines, please.
-            cln += 1
-            new_line = line.strip()
-            new_line = new_line.replace("\n", "")
-            # F*** smart quotes.
-            new_line = new_line.replace("“", "\"")
-            new_line = new_line.replace("”", "\"")
-            # Don't bother adding back blank lines.
-            if new_line != "":
-                fixed_lines.append(new_line)
-                self.original_line_numbers[len(fixed_lines) - 1] = cln
-
-        self.lines = fixed_lines
-
-    def _read_line(self, n: int):
-        return self.lines[n]
-
-    @property
-    def _read_next_line(self):
-        self._skip_next_line = True
-        return self._read_line(self._current_line + 1)
-
-    def _parse_line(self, n: int):
-        self._current_line = n
-        line = self.lines[n]
-
-        # Skip
-        if self._skip_next_line:
-            self._skip_next_line = False
-            return
-
-        # Comments
-        if line.startswith("#"):
-            return
-
-        # Headers
-        if (match := re.match(re_header, line)):
-            header = match.group(1)
-            self._current_header = header
+        # Some errors are found while reading and some while building, so put them back in order.
+        self.errors.sort(key = lambda e: (e.line, e.column))
+        units.flush()
+
+    def _error(self, line: int, column: int, e: ParseError):
+        """Record an error found in a string that starts at `column`."""
+        if e.column is not None:
+            column += e.column - 1
+        self.errors.append(SpecError(line, column, e.message))
+
+    def _read_records(self, lines: Iterable[str]) -> Iterator[Record]:
+        """Turn lines into Records as they're read. A player or event's metadata is the line after it."""
+        current_header = None
+        cleaned = _clean_lines(lines)
+        for n, indent, line in cleaned:
+            self._empty = False
+            # Comments
+            if line.startswith("#"):
+                continue
+
+            # Headers
+            if (match := re_header.match(line)):
+                current_header = match.group(1)
+                continue
+
+            # Setup
+            if current_header == "setup":
+                yield Record("setup", (), n, indent + 1, line, n, indent + 1)
+                continue
+
+            # Arenas
+            if current_header == "arena" and (match := re_arena.match(line)):
+                yield Record("arena", (match.group(1), match.group(2)), n, indent + 1)
+                continue
+
+            # Players and events
+            if current_header == "players":
+                kind = "player"
+            elif current_header in event_headers:
+                kind = "event"
+            elif current_header == "arena":
+                kind = "arenaevent"
+            else:
+                continue
+            if not (match := re_quotes.match(line)):
+                if kind != "arenaevent":
+                    what = "a player" if kind == "player" else "event"
+                    self._error(n, indent + 1, ParseError(f"No quoted string found for {what}!"))
+                continue
+            meta = next(cleaned, None)
+            if meta is None:
+                self._error(n, indent + 1, ParseError("Expected a line of metadata, but the file ended."))
+                continue
+            meta_n, meta_indent, meta_line = meta
+            fields = (current_header, match.group(1)) if kind == "event" else (match.group(1),)
+            yield Record(kind, fields, n, indent + match.start(1) + 1, meta_line, meta_n, meta_indent + 1)
+
+    def _build(self, chunk: List[Record]):
+        """Check a chunk's metadata, resolve all of its units at once, then build its objects."""
+        sizes = set()
+        diffs = set()
+        ready = []
+        for r in chunk:
+            if r.meta is not None:
+                metaparser = MetaParser(record_types[r.kind])
+                try:
+                    meta = r.metadata = metaparser.parse(r.meta)
+                    r.columns = metaparser.columns
+                except ParseError as e:
+                    self._error(r.meta_line, r.meta_column, e)
+                    continue
+                if r.kind == "setup":
+                    sizes.update(s for s in (meta.minsize, meta.maxsize) if s is not None)
+                elif r.kind == "player":
+                    if meta.height is not None:
+                        sizes.add(meta.height)
+                else:
+                    for tag in re_tag.findall(r.fields[-1]):
+                        for f in tag.split("&"):
+                            if len(f) > 1 and f[1] in "<>":
+                                sizes.add(f[2:])
+                    diffs.update(v[1] for v in meta.size or [] if len(v) > 1)
+                    sizes.update(v[1] for v in meta.setsize or [] if len(v) > 1)
+            ready.append(r)
+        SV.parse_many(sizes)
+        Diff.parse_many(diffs)
+        for r in ready:
+            try:
+                self._check_units(r)
+            except ParseError as e:
+                self._error(r.meta_line, r.meta_column, e)
+                continue
+            try:
+                self._parse_record(r)
+            except ParseError as e:
+                self._error(r.line, r.column, e)
+
+    def _check_units(self, r: Record):
+        """Make sure every unit in a record's metadata parses, so that a bad one is reported where it is
+        in the metadata line, not at the player or event it belongs to."""
+        meta = r.metadata
+        if r.kind == "player":
+            unit_items = [("height", 0, SV, meta.height)] if meta.height is not None else []
+        elif r.kind in ("event", "arenaevent"):
+            unit_items = [("size", i, Diff, v[1]) for i, v in enumerate(meta.size or []) if len(v) > 1]
+            unit_items += [("setsize", i, SV, v[1]) for i, v in enumerate(meta.setsize or []) if len(v) > 1]
+        else:
             return
+        for key, i, wrapper, s in unit_items:
+            try:
+                wrapper.parse(s)
+            except ParseError as e:
+                raise ParseError(e.message, column = r.columns[key][i])
 
+    def _parse_record(self, r: Record):
         # Setup
-        if self._current_header == "setup":
-            setup = Setup(line)
+        if r.kind == "setup":
+            setup = Setup(r.meta, metadata = r.metadata)
             self.autoelim = setup.autoelim
             self.teamwin = setup.teamwin
             self.deathrate = setup.deathrate
@@ -113,48 +224,27 @@ class Parser:
             self.minsize = setup.minsize
             self.arenafreq = setup.arenafreq
             self.unitsystem = setup.unitsystem
-            return
 
         # Players
-        elif self._current_header == "players":
-            if (match := re.match(re_quotes, line)):
-                name = match.group(1)
-            else:
-                raise ParseError("No quoted string found for a player!")
-            meta = self._read_next_line
-
-            player = Player(self._game, name, meta)
+        elif r.kind == "player":
+            player = Player(self._game, r.fields[0], r.meta, metadata = r.metadata)
             self.players[player.name] = player
 
         # Events
-        elif self._current_header in ["bloodbath", "day", "night", "fatalday", "fatalnight", "feast"]:
-            if (match := re.match(re_quotes, line)):
-                event_text = match.group(1)
-            else:
-                raise ParseError("No quoted string found for event!")
-            meta = self._read_next_line
-
-            event = Event(self._game, event_text, meta)
-            getattr(self, self._current_header + "_events").append(event)
+        elif r.kind == "event":
+            header, event_text = r.fields
+            event = Event(event_text, r.meta, metadata = r.metadata, shared_dummies = self._dummies)
+            getattr(self, header + "_events").append(event)
 
         # Arenas
-        elif self._current_header == "arena":
-            if (match := re.match(re_arena, line)):
-                if self._current_arena:
-                    self.arenas.append(self._current_arena)
-                    self._current_arena = None
-                arena_name = match.group(1)
-                arena_description = match.group(2)
-                self._current_arena = Arena(arena_name, arena_description)
-            elif (match := re.match(re_quotes, line)):
-                if (match := re.match(re_quotes, line)):
-                    event_text = match.group(1)
-                else:
-                    raise ParseError("No quoted string found for event!")
-                meta = self._read_next_line
-
-                event = Event(self._game, event_text, meta)
-                self._current_arena.add_event(event)
-
-        else:
-            return
+        elif r.kind == "arena":
+            arena_name, arena_description = r.fields
+            if self._current_arena:
+                self.arenas.append(self._current_arena)
+            self._current_arena = Arena(arena_name, arena_description)
+
+        elif r.kind == "arenaevent":
+            if self._current_arena is None:
+                raise ParseError("Arena event found outside of an arena!")
+            event = Event(r.fields[0], r.meta, metadata = r.metadata, shared_dummies = self._dummies)
+            self._current_arena.add_event(event)
@@ -1,91 +1,117 @@
+import logging
 from decimal import Decimal
+from sys import intern
+from typing import Dict
 
 from PIL import Image
 
+from sizeroyale.lib.attrdict import AttrDict
 from sizeroyale.lib.classes.metaparser import MetaParser
 from sizeroyale.lib.errors import GametimeError, ThisShouldNeverHappenException
 from sizeroyale.lib.img_utils import create_profile_picture
 from sizeroyale.lib.units import SV, Diff
 from sizeroyale.lib.utils import isURL
 
+logger = logging.getLogger("sizeroyale")
+
+pronoun_table = {
+    "M": {"subject": "he", "object": "him", "posessive": "his", "posessive2": "his", "reflexive": "himself"},
+    "F": {"subject": "she", "object": "her", "posessive": "her", "posessive2": "hers", "reflexive": "herself"},
+    "X": {"subject": "they", "object": "them", "posessive": "their", "posessive2": "theirs", "reflexive": "themself"}
+}
+
 
 class Player:
     valid_data = [("team", "single"), ("gender", "single"), ("height", "single"), ("url", "single"), ("attr", "list")]
+    __slots__ = ["_game", "_original_metadata", "_metadata", "name", "team", "gender", "height", "url",
+                 "attributes", "_original_height", "_original_attributes", "inventory", "dead", "elims"]
 
-    def __init__(self, game, name: str, meta: str):
+    def __init__(self, game, name: str, meta: str, *, metadata: AttrDict = None):
         self._game = game
-        self._original_metadata = meta
-        self._metadata = MetaParser(type(self)).parse(meta)
+        if metadata is None:
+            metadata = MetaParser(type(self)).parse(meta)
+        # Everything in the metadata ends up in the fields below, so it's only kept for debugging.
+        if logger.isEnabledFor(logging.DEBUG):
+            self._original_metadata = meta
+            self._metadata = metadata
+        else:
+            self._original_metadata = None
+            self._metadata = None
         self.name = name
-        self.team = self._metadata.team
-        self.gender = self._metadata.gender
-        self.height = SV.parse(self._metadata.height) if isinstance(self._metadata.height, str) else SV.parse(str(self._metadata.height) + "m")
-        if not isURL(self._metadata.url):
-            raise ValueError(f"{self._metadata.url} is not a URL.")
-        self.url = self._metadata.url
-        self.attributes = [] if self._metadata.attr is None else self._metadata.attr
+        # Teams, genders and attributes repeat across players and events, so they're interned.
+        self.team = None if metadata.team is None else intern(metadata.team)
+        self.gender = None if metadata.gender is None else intern(metadata.gender)
+        self.height = SV.parse(metadata.height) if isinstance(metadata.height, str) else SV.parse(str(metadata.height) + "m")
+        if not isURL(metadata.url):
+            raise ValueError(f"{metadata.url} is not a URL.")
+        self.url = metadata.url
+        self._original_height = self.height
+        self._original_attributes = () if metadata.attr is None else tuple(intern(a) for a in metadata.attr)
+        self.attributes = list(self._original_attributes)
 
         self.inventory = []
         self.dead = False
         self.elims = 0
 
+    def reset(self):
+        """Put this player back the way they were when the spec was parsed."""
+        self.height = self._original_height
+        self.attributes = list(self._original_attributes)
+        self.inventory = []
+        self.dead = False
+        self.elims = 0
+
+    def snapshot(self) -> tuple:
+        """Everything about this player that changes during a game, as a tuple that won't change."""
+        return (self.height, tuple(self.attributes), tuple(self.inventory), self.dead, self.elims)
+
+    def restore(self, state: tuple):
+        """Put this player back the way they were in a snapshot()."""
+        height, attributes, inventory, dead, elims = state
+        self.height = height
+        self.attributes = list(attributes)
+        self.inventory = list(inventory)
+        self.dead = dead
+        self.elims = elims
+
     @property
     def image(self) -> Image:
-        return create_profile_picture(self._game.royale.unitsystem, self.url, self.name, self.team, self.height, self.dead)
+        height_text = SV.format(self.height, self._game.royale.unitsystem)
+        return create_profile_picture(self.url, self.name, self.team, height_text, self.dead)
+
+    @property
+    def card(self) -> tuple:
+        """Everything needed to draw this player's card as they are right now."""
+        return (self.url, self.name, self.team, self.height, self.dead)
+
+    @property
+    def pronouns(self) -> Dict[str, str]:
+        """This player's pronouns, by kind."""
+        try:
+            return pronoun_table[self.gender]
+        except KeyError:
+            raise ThisShouldNeverHappenException(f"Invalid gender {self.gender!r} on player {self.name!r}.")
 
     @property
     def subject(self) -> str:
-        if self.gender == "M":
-            return "he"
-        elif self.gender == "F":
-            return "she"
-        elif self.gender == "X":
-            return "they"
+        return self.pronouns["subject"]
 
     @property
     def object(self) -> str:
-        if self.gender == "M":
-            return "him"
-        elif self.gender == "F":
-            return "her"
-        elif self.gender == "X":
-            return "them"
-        else:
-            raise ThisShouldNeverHappenException(f"Invalid gender {self.gender!r} on player {self.name!r}.")
+        return self.pronouns["object"]
 
     @property
     def posessive(self) -> str:
-        if self.gender == "M":
-            return "his"
-        elif self.gender == "F":
-            return "her"
-        elif self.gender == "X":
-            return "their"
-        else:
-            raise ThisShouldNeverHappenException(f"Invalid gender {self.gender!r} on player {self.name!r}.")
+        return self.pronouns["posessive"]
 
     # Unused, hope we don't need this.
     @property
     def posessive2(self) -> str:
-        if self.gender == "M":
-            return "his"
-        elif self.gender == "F":
-            return "hers"
-        elif self.gender == "X":
-            return "theirs"
-        else:
-            raise ThisShouldNeverHappenException(f"Invalid gender {self.gender!r} on player {self.name!r}.")
+        return self.pronouns["posessive2"]
 
     @property
     def reflexive(self) -> str:
-        if self.gender == "M":
-            return "himself"
-        elif self.gender == "F":
-            return "herself"
-        elif self.gender == "X":
-            return "themself"
-        else:
-            raise ThisShouldNeverHappenException(f"Invalid gender {self.gender!r} on player {self.name!r}.")
+        return self.pronouns["reflexive"]
 
     def give_item(self, item: str):
         self.inventory.append(item)
@@ -0,0 +1,372 @@
+from bisect import bisect_left, bisect_right
+from operator import attrgetter
+from typing import Dict, Iterator, List, Mapping, Optional
+
+from sizeroyale.lib.classes.dummyplayer import DummyPlayer
+from sizeroyale.lib.classes.player import Player
+from sizeroyale.lib.classes.requirements import Requirements
+
+# How many random picks to try before filtering a whole bucket.
+SAMPLE_TRIES = 8
+
+
+class Bucket:
+    """An ordered set of player names with O(1) removal and random access.
+    Removal swaps the last name into the gap, so the order only depends on what was removed."""
+    __slots__ = ["names", "_positions"]
+
+    def __init__(self):
+        self.names: List[str] = []
+        # Where each name is in `names`, or None if it needs working out again.
+        self._positions: Optional[Dict[str, int]] = {}
+
+    def copy(self) -> "Bucket":
+        bucket = Bucket()
+        bucket.names = list(self.names)
+        bucket._positions = dict(zip(bucket.names, range(len(bucket.names))))
+        return bucket
+
+    def add(self, name: str):
+        if self._positions is not None:
+            self._positions[name] = len(self.names)
+        self.names.append(name)
+
+    def insert(self, name: str, order: Dict[str, int]) -> int:
+        """Add a name where it goes in `order`, for buckets kept in that order. Returns where it went."""
+        low, high = 0, len(self.names)
+        while low < high:
+            mid = (low + high) // 2
+            if order[self.names[mid]] < order[name]:
+                low = mid + 1
+            else:
+                high = mid
+        self.names.insert(low, name)
+        self._positions = None
+        return low
+
+    def remove(self, name: str) -> int:
+        """Take a name out without changing the order of the rest. Returns where it was."""
+        i = self.names.index(name)
+        del self.names[i]
+        self._positions = None
+        return i
+
+    def discard(self, name: str):
+        if self._positions is None:
+            self._positions = dict(zip(self.names, range(len(self.names))))
+        i = self._positions.pop(name, None)
+        if i is None:
+            return
+        last = self.names.pop()
+        if i < len(self.names):
+            self.names[i] = last
+            self._positions[last] = i
+
+    def __len__(self):
+        return len(self.names)
+
+
+class PlayerPool:
+    """
+    The players that haven't had an event yet this round, indexed by height, team,
+    gender, attribute and item, so an Event can find players for its DummyPlayers
+    without scanning everyone.
+    Players leave the pool with pop(), and it otherwise behaves like a read-only dict.
+    A pool can also be kept between rounds with update(), and copy()'d for each round.
+    """
+    def __init__(self, players: Mapping[str, Player]):
+        self._players: Dict[str, Player] = dict(players)
+        # Where each player was in `players`, which every bucket and index keeps to.
+        self._order: Dict[str, int] = dict(zip(self._players, range(len(self._players))))
+        self._all = Bucket()
+        self._heights = []
+        self._height_names = []
+        self._by_team: Dict[str, Bucket] = {}
+        self._by_gender: Dict[str, Bucket] = {}
+        self._by_attribute: Dict[str, Bucket] = {}
+        self._by_item: Dict[str, Bucket] = {}
+        # What each player was indexed under, since events can change players before they leave the pool.
+        self._indexed: Dict[str, tuple] = {}
+        # Indexes whose keys update() has put out of order, sorted again before the next copy().
+        self._unsorted: List[dict] = []
+        for name, p in self._players.items():
+            attributes = tuple(dict.fromkeys(p.attributes))
+            items = tuple(dict.fromkeys(p.inventory))
+            self._indexed[name] = (p.height, p.team, p.gender, attributes, items)
+            self._all.add(name)
+            self._bucket(self._by_team, p.team).add(name)
+            self._bucket(self._by_gender, p.gender).add(name)
+            for attribute in attributes:
+                self._bucket(self._by_attribute, attribute).add(name)
+            for item in items:
+                self._bucket(self._by_item, item).add(name)
+        for height, name in sorted((p.height, n) for n, p in self._players.items()):
+            self._heights.append(height)
+            self._height_names.append(name)
+        self._count_elims()
+
+    def _count_elims(self):
+        # Players' elims don't change while they're in the pool, and these stay safe bounds as players leave.
+        elims = list(map(attrgetter("elims"), self._players.values()))
+        self._min_elims = min(elims, default = 0)
+        self._max_elims = max(elims, default = 0)
+
+    @staticmethod
+    def _bucket(index: dict, key) -> Bucket:
+        if key not in index:
+            index[key] = Bucket()
+        return index[key]
+
+    def copy(self) -> "PlayerPool":
+        """A pool of the same players that can be popped from without changing this one."""
+        for index in self._unsorted:
+            self._sort_keys(index)
+        self._unsorted = []
+        pool = PlayerPool.__new__(PlayerPool)
+        pool._players = dict(self._players)
+        pool._order = self._order
+        pool._all = self._all.copy()
+        pool._heights = list(self._heights)
+        pool._height_names = list(self._height_names)
+        pool._by_team = {k: b.copy() for k, b in self._by_team.items()}
+        pool._by_gender = {k: b.copy() for k, b in self._by_gender.items()}
+        pool._by_attribute = {k: b.copy() for k, b in self._by_attribute.items()}
+        pool._by_item = {k: b.copy() for k, b in self._by_item.items()}
+        pool._indexed = dict(self._indexed)
+        pool._unsorted = []
+        pool._count_elims()
+        return pool
+
+    def update(self, player: Player, present: bool = True):
+        """Index a player again after they've changed, or take them out if they're no longer `present`.
+        Everything stays in the order a new PlayerPool of the same players would have,
+        so a pool kept up to date this way draws exactly the same players as a new one."""
+        name = player.name
+        if name not in self._indexed:
+            return
+        old = self._indexed[name]
+        if present:
+            new = (player.height, player.team, player.gender,
+                   tuple(dict.fromkeys(player.attributes)), tuple(dict.fromkeys(player.inventory)))
+            if new == old:
+                return
+        height, team, gender, attributes, items = old
+        i = bisect_left(self._heights, height)
+        while self._height_names[i] != name:
+            i += 1
+        del self._heights[i]
+        del self._height_names[i]
+        if not present:
+            del self._players[name]
+            del self._indexed[name]
+            self._all.remove(name)
+            for index, keys in ((self._by_team, [team]), (self._by_gender, [gender]),
+                                (self._by_attribute, attributes), (self._by_item, items)):
+                for key in keys:
+                    self._remove(index, key, name)
+            return
+        new_height, new_team, new_gender, new_attributes, new_items = new
+        self._indexed[name] = new
+        i = bisect_left(self._heights, new_height)
+        while i < len(self._heights) and self._heights[i] == new_height and self._height_names[i] < name:
+            i += 1
+        self._heights.insert(i, new_height)
+        self._height_names.insert(i, name)
+        # Most events only change heights.
+        if new[1:] == old[1:]:
+            return
+        for index, keys, new_keys in ((self._by_team, [team], [new_team]), (self._by_gender, [gender], [new_gender]),
+                                      (self._by_attribute, attributes, new_attributes), (self._by_item, items, new_items)):
+            for key in keys:
+                if key not in new_keys:
+                    self._remove(index, key, name)
+            for key in new_keys:
+                if key not in keys:
+                    self._insert(index, key, name)
+
+    def _remove(self, index: dict, key, name: str):
+        bucket = index[key]
+        if bucket.remove(name) == 0:
+            if not bucket:
+                del index[key]
+            elif not any(i is index for i in self._unsorted):
+                self._unsorted.append(index)
+
+    def _insert(self, index: dict, key, name: str):
+        if key not in index:
+            index[key] = Bucket()
+        if index[key].insert(name, self._order) == 0 and not any(i is index for i in self._unsorted):
+            self._unsorted.append(index)
+
+    def _sort_keys(self, index: dict):
+        """Put an index's keys back in the order of their first players, the order a new pool adds them in."""
+        ordered = sorted(index.items(), key = lambda item: self._order[item[1].names[0]])
+        index.clear()
+        index.update(ordered)
+
+    def pop(self, name: str) -> Player:
+        p = self._players.pop(name)
+        height, team, gender, attributes, items = self._indexed.pop(name)
+        self._all.discard(name)
+        for index, keys in ((self._by_team, [team]), (self._by_gender, [gender]),
+                            (self._by_attribute, attributes), (self._by_item, items)):
+            for key in keys:
+                bucket = index[key]
+                bucket.discard(name)
+                if not bucket:
+                    del index[key]
+        i = bisect_left(self._heights, height)
+        while self._height_names[i] != name:
+            i += 1
+        del self._heights[i]
+        del self._height_names[i]
+        return p
+
+    @property
+    def teams(self) -> List[str]:
+        """Every team with a player in the pool, in a reproducible order."""
+        return list(self._by_team)
+
+    def team_size(self, team: str) -> int:
+        return len(self._by_team[team]) if team in self._by_team else 0
+
+    def might_fit(self, requirements: Requirements) -> bool:
+        """Whether the pool might have players for an event, judging only by counts and bounds.
+        False means the event can't happen, True means it's worth trying to match."""
+        if len(self._players) < requirements.tributes or len(self._by_team) < requirements.teams:
+            return False
+        if requirements.lessthan is not None and not (self._heights and self._heights[0] <= requirements.lessthan):
+            return False
+        if requirements.greaterthan is not None and not (self._heights and self._heights[-1] >= requirements.greaterthan):
+            return False
+        if requirements.elimslessthan is not None and self._min_elims >= requirements.elimslessthan:
+            return False
+        if requirements.elimsgreaterthan is not None and self._max_elims <= requirements.elimsgreaterthan:
+            return False
+        for elims in requirements.elimsequal:
+            if not self._min_elims <= elims <= self._max_elims:
+                return False
+        for item, count in requirements.items.items():
+            if item not in self._by_item or len(self._by_item[item]) < count:
+                return False
+        for attribute, count in requirements.attributes.items():
+            if attribute not in self._by_attribute or len(self._by_attribute[attribute]) < count:
+                return False
+        for gender, count in requirements.genders.items():
+            if sum(len(b) for g, b in self._by_gender.items() if g is not None and gender in g) < count:
+                return False
+        return True
+
+    def _height_range(self, dummy: DummyPlayer) -> tuple:
+        low = 0 if dummy.greaterthan is None else bisect_left(self._heights, dummy.greaterthan)
+        high = len(self._heights) if dummy.lessthan is None else bisect_right(self._heights, dummy.lessthan)
+        return low, max(low, high)
+
+    def _candidates(self, dummy: DummyPlayer, teams: Mapping[str, str] = None) -> list:
+        """The smallest list of names that must contain every player the dummy matches."""
+        options = [self._all.names]
+        if dummy.lessthan is not None or dummy.greaterthan is not None:
+            low, high = self._height_range(dummy)
+            options.append(self._height_names[low:high])
+        if teams is not None and dummy.team in teams:
+            team = teams[dummy.team]
+            options.append(self._by_team[team].names if team in self._by_team else [])
+        if dummy.gender is not None:
+            options.append([n for g, b in self._by_gender.items() if g is not None and dummy.gender in g for n in b.names])
+        for attribute in dummy.attributes or []:
+            options.append(self._by_attribute[attribute].names if attribute in self._by_attribute else [])
+        for item in dummy.items or []:
+            options.append(self._by_item[item].names if item in self._by_item else [])
+        return min(options, key = len)
+
+    def sample(self, dummy: DummyPlayer, rng, exclude = (), teams: Mapping[str, str] = None) -> Optional[Player]:
+        """Pick a player the dummy matches uniformly at random, or None if there isn't one."""
+        candidates = self._candidates(dummy, teams)
+        if not candidates:
+            return None
+        # Most dummies match most of their candidates, so try a few random picks first.
+        for _ in range(SAMPLE_TRIES):
+            name = candidates[rng.randrange(len(candidates))]
+            if name not in exclude and dummy.matches(self._players[name], teams):
+                return self._players[name]
+        matching = [n for n in candidates if n not in exclude and dummy.matches(self._players[n], teams)]
+        if not matching:
+            return None
+        return self._players[matching[rng.randrange(len(matching))]]
+
+    def matching(self, dummy: DummyPlayer, rng, teams: Mapping[str, str] = None) -> List[str]:
+        """Every player the dummy matches, in a random order."""
+        names = [n for n in self._candidates(dummy, teams) if dummy.matches(self._players[n], teams)]
+        rng.shuffle(names)
+        return names
+
+    def match(self, dummies: List[DummyPlayer], rng, teams: Mapping[str, str] = None) -> Optional[Dict[str, Player]]:
+        """Assign a different player to each dummy, in the dummies' order, or return None if there's no way to.
+        `teams` gives the real team each team letter has to be, for dummies with one.
+        Each dummy gets a random free player it matches. If there aren't any left, the
+        dummies before it are moved to other players they match to make room for it."""
+        owners = {}
+        for i, d in enumerate(dummies):
+            p = self.sample(d, rng, exclude = owners, teams = teams)
+            if p is None:
+                # Making room for this dummy means moving others, so there has to be someone to move.
+                return self._match_rest(dummies, i, owners, rng, teams) if owners else None
+            owners[p.name] = i
+        return {n: self._players[n] for n in owners}
+
+    def _match_rest(self, dummies: List[DummyPlayer], start: int, owners: dict, rng,
+                    teams: Mapping[str, str] = None) -> Optional[Dict[str, Player]]:
+        assigned = [None] * len(dummies)
+        for name, i in owners.items():
+            assigned[i] = name
+        options = {}
+        for i in range(start, len(dummies)):
+            p = None if i == start else self.sample(dummies[i], rng, exclude = owners, teams = teams)
+            if p is not None:
+                assigned[i] = p.name
+                owners[p.name] = i
+            elif not self._augment(i, dummies, assigned, owners, options, set(), rng, teams):
+                return None
+        return {n: self._players[n] for n in assigned}
+
+    def _augment(self, i: int, dummies: List[DummyPlayer], assigned: list, owners: dict,
+                 options: dict, visited: set, rng, teams: Mapping[str, str] = None) -> bool:
+        """Find dummy i a player, taking one from another dummy if that dummy can be given a different one."""
+        if i not in options:
+            options[i] = self.matching(dummies[i], rng, teams)
+        for name in options[i]:
+            if name in visited:
+                continue
+            visited.add(name)
+            owner = owners.get(name)
+            if owner is None or self._augment(owner, dummies, assigned, owners, options, visited, rng, teams):
+                if assigned[i] is not None and owners.get(assigned[i]) == i:
+                    del owners[assigned[i]]
+                assigned[i] = name
+                owners[name] = i
+                return True
+        return False
+
+    def __getitem__(self, name: str) -> Player:
+        return self._players[name]
+
+    def __contains__(self, name) -> bool:
+        return name in self._players
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._players)
+
+    def __len__(self) -> int:
+        return len(self._players)
+
+    def keys(self):
+        return self._players.keys()
+
+    def values(self):
+        return self._players.values()
+
+    def items(self):
+        return self._players.items()
+
+    def __repr__(self):
+        return f"PlayerPool({list(self._players)!r})"
@@ -0,0 +1,44 @@
+from typing import Dict, Iterable
+
+from sizeroyale.lib.classes.dummyplayer import DummyPlayer
+
+
+# Most events need no genders, items or attributes, so they all share one empty count. Don't change it.
+_no_counts = {}
+
+
+def _count(keys: Iterable[str]) -> Dict[str, int]:
+    # Counter is slow to make.
+    counts = {}
+    for k in keys:
+        counts[k] = counts.get(k, 0) + 1
+    return counts or _no_counts
+
+
+class Requirements:
+    """
+    What an Event needs from the pool as a whole, boiled down from its DummyPlayers
+    so that PlayerPool.might_fit() can rule it out without trying to match anyone.
+    """
+    __slots__ = ["tributes", "teams", "lessthan", "greaterthan", "genders", "items", "attributes",
+                 "elimslessthan", "elimsgreaterthan", "elimsequal"]
+
+    def __init__(self, dummies: Iterable[DummyPlayer]):
+        dummies = list(dummies)
+        self.tributes = len(dummies)
+        self.teams = len({d.team for d in dummies if d.team})
+        # The tightest bounds: someone has to be at least this short, and someone at least this tall.
+        self.lessthan = min((d.lessthan for d in dummies if d.lessthan is not None), default = None)
+        self.greaterthan = max((d.greaterthan for d in dummies if d.greaterthan is not None), default = None)
+        self.genders = _count(d.gender for d in dummies if d.gender is not None)
+        self.items = _count(i for d in dummies if d.items for i in dict.fromkeys(d.items))
+        self.attributes = _count(a for d in dummies if d.attributes for a in dict.fromkeys(d.attributes))
+        self.elimslessthan = min((d.elimslessthan for d in dummies if d.elimslessthan is not None), default = None)
+        self.elimsgreaterthan = max((d.elimsgreaterthan for d in dummies if d.elimsgreaterthan is not None), default = None)
+        self.elimsequal = tuple(dict.fromkeys(d.elimsequal for d in dummies if d.elimsequal is not None))
+
+    def __str__(self):
+        return repr(self)
+
+    def __repr__(self):
+        return "Requirements(" + ", ".join(f"{k}={getattr(self, k)!r}" for k in self.__slots__) + ")"
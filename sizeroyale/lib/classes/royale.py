@@ -1,15 +1,20 @@
 import logging
+from collections import Counter
 from decimal import Decimal
+from types import MappingProxyType
 
 from sizeroyale.lib.loglevels import ROYALE
-from typing import Dict, Optional
+from typing import Mapping, Optional
 
 from sizeroyale.lib.attrdict import AttrDict
 from sizeroyale.lib.classes.event import Event
-from sizeroyale.lib.classes.parser import Parser
+from sizeroyale.lib.classes.eventsampler import EventSampler
 from sizeroyale.lib.classes.player import Player
+from sizeroyale.lib.classes.playerpool import PlayerPool
 from sizeroyale.lib.errors import GametimeError
-from sizeroyale.lib.img_utils import create_stats_screen, merge_images
+from sizeroyale.lib.img_utils import LazyImage, StatsScreen, create_cards_image
+from sizeroyale.lib.listdict import ListDict
+from sizeroyale.lib.speccache import spec_cache
 from sizeroyale.lib.units import SV
 
 logger = logging.getLogger("sizeroyale")
@@ -18,34 +23,43 @@ logger = logging.getLogger("sizeroyale")
 class Royale:
     def __init__(self, file, game):
         self._file = file
+        # Headless royales don't log events or draw anything.
+        self.headless = getattr(game, "headless", False)
 
         try:
-            with open(self._file) as f:
-                lines = f.readlines()
-                self.parser = Parser(game, lines)
+            # Only parsed if this exact spec hasn't been compiled before.
+            self.spec = spec_cache.get(self._file, game)
         except FileNotFoundError:
             logger.error("The file {self._file} could not be found!")
             exit(1)
 
-        self.minsize = SV.parse("1mm") if self.parser.minsize is None else SV.parse(self.parser.minsize)
-        self.maxsize = SV.parse("4mi") if self.parser.maxsize is None else SV.parse(self.parser.maxsize)
-        self.autoelim = True if self.parser.autoelim is None else bool(self.parser.autoelim)
-        self.deathrate = Decimal(10) if self.parser.deathrate is None else Decimal(self.parser.deathrate)
-        self.arenafreq = Decimal(10) if self.parser.deathrate is None else Decimal(self.parser.deathrate)
-        self.unitsystem = "m" if self.parser.unitsystem is None else self.parser.unitsystem
-        self.teamwin = False if self.parser.teamwin is None else bool(self.parser.teamwin)
+        self.minsize = SV.parse("1mm") if self.spec.minsize is None else self.spec.minsize
+        self.maxsize = SV.parse("4mi") if self.spec.maxsize is None else self.spec.maxsize
+        self.autoelim = True if self.spec.autoelim is None else bool(self.spec.autoelim)
+        self.deathrate = Decimal(10) if self.spec.deathrate is None else Decimal(self.spec.deathrate)
+        self.arenafreq = Decimal(10) if self.spec.deathrate is None else Decimal(self.spec.deathrate)
+        self.unitsystem = "m" if self.spec.unitsystem is None else self.spec.unitsystem
+        self.teamwin = False if self.spec.teamwin is None else bool(self.spec.teamwin)
 
-        self.players = self.parser.players
+        self.players = self.spec.create_players(game)
         self.original_player_count = len(self.players)
-
-        self.arenas = self.parser.arenas
-
-        self._bloodbath_events = self.parser.bloodbath_events
-        self._day_events = self.parser.day_events
-        self._night_events = self.parser.night_events
-        self._fatalday_events = self.parser.fatalday_events
-        self._fatalnight_events = self.parser.fatalnight_events
-        self._feast_events = self.parser.feast_events
+        self._stats_screen = StatsScreen(self.players, self.unitsystem)
+        # Kept up to date as players die or change size, instead of being rebuilt on every access.
+        self._alive = {}
+        self._team_alive = Counter()
+        # The alive players, indexed for the next round, and who's changed since it was brought up to date.
+        self._pool = None
+        self._pool_changed = {}
+        self._rebuild_alive()
+
+        self.arenas = self.spec.arenas
+
+        self._bloodbath_events = self.spec.bloodbath_events
+        self._day_events = self.spec.day_events
+        self._night_events = self.spec.night_events
+        self._fatalday_events = self.spec.fatalday_events
+        self._fatalnight_events = self.spec.fatalnight_events
+        self._feast_events = self.spec.feast_events
         eventsdict = {
             "bloodbath_events": self._bloodbath_events,
             "day_events": self._day_events,
@@ -55,18 +69,75 @@ class Royale:
             "feast_events": self._feast_events
         }
         self.events = AttrDict(eventsdict)
+        # Event type -> EventSampler, built once here instead of on every draw.
+        self.event_samplers = {k.removesuffix("_events"): EventSampler(v) for k, v in eventsdict.items()}
+        # The arenas are shared with other games from the same spec, so their samplers live here.
+        self.arena_samplers = {a: EventSampler(a.events) for a in self.arenas}
+
+    def restore_events(self):
+        """Let every event be drawn again, after some were excluded for a round."""
+        for sampler in self.event_samplers.values():
+            sampler.restore()
+        for sampler in self.arena_samplers.values():
+            sampler.restore()
+
+    def reset(self):
+        """Put every player back the way they were when the spec was parsed."""
+        for p in self.players.values():
+            p.reset()
+        self._players_changed()
+
+    def restore(self, states: Mapping[str, tuple]):
+        """Put every player back the way they were in a snapshot, from Player.snapshot() states by name."""
+        for name, state in states.items():
+            self.players[name].restore(state)
+        self._players_changed()
+
+    def _players_changed(self):
+        self._rebuild_alive()
+        self._stats_screen.invalidate()
+
+    def _rebuild_alive(self):
+        """Recheck every player. Use this after changing players outside of _run_event()."""
+        self._alive = {k: v for k, v in self.players.items() if self.is_player_alive(v)}
+        self._team_alive = Counter(p.team for p in self._alive.values())
+        self._pool = None
+        self._pool_changed = {}
+
+    def _update_alive(self, player: Player):
+        """Recheck one player after their height or death changed."""
+        alive = self.is_player_alive(player)
+        if not alive and player.name in self._alive:
+            del self._alive[player.name]
+            self._team_alive[player.team] -= 1
+            if self._team_alive[player.team] == 0:
+                del self._team_alive[player.team]
+        elif alive and player.name not in self._alive:
+            # Players don't come back during a game, but keep the original order if they do.
+            self._rebuild_alive()
 
     @property
-    def alive_players(self) -> dict:
-        return {k: v for k, v in self.players.items() if self.is_player_alive(v)}
+    def alive_players(self) -> Mapping[str, Player]:
+        """A read-only view of the players still in the game. Copy it before changing it."""
+        return MappingProxyType(self._alive)
+
+    def player_pool(self) -> PlayerPool:
+        """A new pool of the players still in the game, for a round."""
+        if self._pool is None:
+            self._pool = PlayerPool(self._alive)
+        else:
+            for name, p in self._pool_changed.items():
+                self._pool.update(p, name in self._alive)
+        self._pool_changed = {}
+        return self._pool.copy()
 
     @property
     def dead_players(self) -> dict:
-        return {k: v for k, v in self.players.items() if not self.is_player_alive(v)}
+        return {k: v for k, v in self.players.items() if k not in self._alive}
 
     @property
     def remaining(self) -> int:
-        return len(self.alive_players)
+        return len(self._alive)
 
     @property
     def current_players(self) -> str:
@@ -75,24 +146,21 @@ class Royale:
 
     @property
     def current_teams(self) -> list:
-        s = set()
-        for player in self.alive_players.values():
-            s.add(player.team)
-        return list(s)
+        return list(self._team_alive)
 
     @property
     def game_over(self) -> Optional[int]:
         """Returns the winning team, or None if the game isn't over."""
         if self.teamwin:
-            if len(self.current_teams) == 1:
-                return self.current_teams[0]
-            elif len(self.current_teams) == 0:
+            if len(self._team_alive) == 1:
+                return next(iter(self._team_alive))
+            elif len(self._team_alive) == 0:
                 return 0
             else:
                 return None
         else:
             if self.remaining == 1:
-                player = next(i for i in self.alive_players.items())
+                player = next(iter(self._alive.items()))
                 return player
             elif self.remaining == 0:
                 return 0
@@ -101,26 +169,30 @@ class Royale:
 
     @property
     def stats_screen(self):
-        return create_stats_screen(self.players)
+        return self._stats_screen.update()
 
     def is_player_alive(self, player) -> bool:
         if self.autoelim:
             return player.height > self.minsize and player.height < self.maxsize and player.dead is False
         return player.dead is False
 
-    def _run_event(self, event: Event, playerpool: Dict[str, Player]) -> dict:
-        """Runs an event, returning the string describing what happened and an image."""
-        if event.tributes > len(playerpool):
-            raise GametimeError("Not enough players to run this event!")
-        players = event.get_players(playerpool)
+    def _run_event(self, event: Event, players: ListDict[str, Player]) -> dict:
+        """Runs an event on the players Event.get_players() picked for it, returning the string
+        describing what happened and an image.
+        The image is a LazyImage of the players as they were right after the event."""
+        if event.tributes != len(players):
+            raise GametimeError("Wrong number of players for this event!")
 
         eventtext = event.fillin(players)
         deaths = []
 
-        logger.log(ROYALE, "[EVENT] " + eventtext)
+        if not self.headless:
+            logger.log(ROYALE, "[EVENT] " + eventtext)
+
+        by_id = list(players)
 
         def player_by_id(pid):
-            return self.players[players.getByIndex(pid - 1).name]
+            return self.players[by_id[pid - 1]]
 
         if event.elims is not None:
             for i in event.elims:
@@ -152,17 +224,26 @@ class Royale:
                 player_by_id(i).remove_attribute(s)
 
         if event.setsizes is not None:
-            for i, d in event.sizes:
+            for i, d in event.setsizes:
                 player_by_id(i).height = d
 
         if event.sizes is not None:
             for i, d in event.sizes:
                 player_by_id(i).change_height(d)
 
-        if len(players) == 0:
+        for p in players:
+            self._update_alive(self.players[p])
+        # Only events that change what the pool indexes players by mean updating it for the next round.
+        if (event.elims or event.gives or event.removes or event.clears or event.giveattrs or event.removeattrs
+                or event.setsizes or event.sizes):
+            for p in players:
+                self._pool_changed[p] = self.players[p]
+
+        if self.headless or len(players) == 0:
             eventimage = None
         else:
-            eventimage = merge_images([self.players[p].image for p in players])
+            self._stats_screen.mark(*(self.players[p] for p in players))
+            eventimage = LazyImage(create_cards_image, [self.players[p].card for p in players], self.unitsystem)
 
         return {
             "text": eventtext,
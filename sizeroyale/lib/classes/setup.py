@@ -1,3 +1,4 @@
+from sizeroyale.lib.attrdict import AttrDict
 from sizeroyale.lib.classes.metaparser import MetaParser
 
 
@@ -6,9 +7,9 @@ class Setup:
                   ("maxsize", "single"), ("minsize", "single"), ("arenafreq", "single"),
                   ("unitsystem", "single")]
 
-    def __init__(self, meta):
+    def __init__(self, meta, *, metadata: AttrDict = None):
         self._original_metadata = meta
-        self._metadata = MetaParser(type(self)).parse(meta)
+        self._metadata = MetaParser(type(self)).parse(meta) if metadata is None else metadata
         self.autoelim = self._metadata.autoelim
         self.teamwin = self._metadata.teamwin
         self.deathrate = self._metadata.deathrate
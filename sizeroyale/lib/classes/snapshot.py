@@ -0,0 +1,66 @@
+from decimal import Decimal
+from typing import Dict, Optional, Tuple
+
+
+class GameSnapshot:
+    """
+    Everything about a Game that changes while it's played, between rounds.
+    Nothing in a snapshot changes after it's taken, so snapshots can be kept, forked and
+    restored any number of times. The parsed spec isn't in it; it's shared by every game
+    made from the same spec, so a snapshot can be restored into any of them.
+    Players that haven't changed since the last snapshot share their state with it.
+    """
+    __slots__ = ["players", "seed", "random_state", "current_day", "current_event_type",
+                 "current_arena", "running_arena", "feasted", "unreported_deaths"]
+
+    def __init__(self, *, players: Dict[str, tuple], seed, random_state: tuple, current_day: int,
+                 current_event_type: Optional[str], current_arena: Optional[int], running_arena: bool,
+                 feasted: bool, unreported_deaths: Tuple[str, ...]):
+        # Player name -> Player.snapshot()
+        self.players = players
+        self.seed = seed
+        self.random_state = random_state
+        self.current_day = current_day
+        self.current_event_type = current_event_type
+        # An index into the royale's arenas, so that snapshots survive being pickled.
+        self.current_arena = current_arena
+        self.running_arena = running_arena
+        self.feasted = feasted
+        # Names of the players who died since the last cannon shots.
+        self.unreported_deaths = unreported_deaths
+
+    def dump(self) -> dict:
+        """This snapshot as plain JSON-able data, for load()."""
+        version, internal, gauss = self.random_state
+        return {
+            "players": {n: [str(height), list(attributes), list(inventory), dead, elims]
+                        for n, (height, attributes, inventory, dead, elims) in self.players.items()},
+            "seed": self.seed,
+            "random_state": [version, list(internal), gauss],
+            "current_day": self.current_day,
+            "current_event_type": self.current_event_type,
+            "current_arena": self.current_arena,
+            "running_arena": self.running_arena,
+            "feasted": self.feasted,
+            "unreported_deaths": list(self.unreported_deaths)
+        }
+
+    @classmethod
+    def load(cls, data: dict) -> "GameSnapshot":
+        version, internal, gauss = data["random_state"]
+        return cls(
+            players = {n: (Decimal(height), tuple(attributes), tuple(inventory), dead, elims)
+                       for n, (height, attributes, inventory, dead, elims) in data["players"].items()},
+            seed = data["seed"],
+            random_state = (version, tuple(internal), gauss),
+            current_day = data["current_day"],
+            current_event_type = data["current_event_type"],
+            current_arena = data["current_arena"],
+            running_arena = data["running_arena"],
+            feasted = data["feasted"],
+            unreported_deaths = tuple(data["unreported_deaths"])
+        )
+
+    def __repr__(self):
+        return (f"GameSnapshot(seed={self.seed!r}, current_day={self.current_day!r}, "
+                f"current_event_type={self.current_event_type!r}, players={len(self.players)})")
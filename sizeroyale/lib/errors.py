@@ -10,7 +10,10 @@ class CustomError(Exception):
 
 
 class ParseError(CustomError):
-    pass
+    def __init__(self, *args, column: int = None):
+        super().__init__(*args)
+        # Where the problem starts in the string being parsed, counting from 1, if it's known.
+        self.column = column
 
 
 class DownloadError(ParseError):
@@ -31,3 +34,19 @@ class OutOfEventsError(GametimeError):
 
 class ThisShouldNeverHappenException(CustomError):
     level = logging.CRITICAL
+
+
+class SpecError:
+    """A problem found while parsing a spec, and where it is. Not raised; the parser collects these."""
+    __slots__ = ["line", "column", "message"]
+
+    def __init__(self, line: int, column: int, message: str):
+        self.line = line
+        self.column = column
+        self.message = message
+
+    def __str__(self):
+        return f"Line {self.line}, column {self.column}: {self.message}"
+
+    def __repr__(self):
+        return f"SpecError(line={self.line!r}, column={self.column!r}, message={self.message!r})"
@@ -0,0 +1,225 @@
+import atexit
+import hashlib
+import json
+import logging
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import requests
+
+from sizeroyale.lib.cachedir import cache_dir
+from sizeroyale.lib.errors import DownloadError
+
+logger = logging.getLogger("sizeroyale")
+
+
+class ImageCache:
+    """
+    A persistent, content-addressed cache of downloaded files.
+    Each file is stored once under the SHA-256 of its contents, and an index maps
+    URLs to those hashes along with their ETag and Last-Modified headers.
+    Entries newer than `revalidate_after` seconds are served without touching
+    the network; older ones are revalidated with If-None-Match/If-Modified-Since,
+    so they're only downloaded again if they've changed.
+    When the files take up more than `maxbytes`, the least recently used are evicted.
+    """
+    version = 1
+
+    def __init__(self, path, *, maxbytes: int = 100 * 1024 * 1024, revalidate_after: float = 24 * 60 * 60):
+        self.path = Path(path)
+        self.blob_path = self.path / "blobs"
+        self.blob_path.mkdir(parents = True, exist_ok = True)
+        self.index_path = self.path / "index.json"
+        self.maxbytes = maxbytes
+        self.revalidate_after = revalidate_after
+        self._index = {}
+        # How many URLs point to each file, and how many threads are reading or writing it.
+        # A file is only deleted once both are 0, so files are read and written without holding the lock.
+        self._refs: Dict[str, int] = {}
+        self._pins: Dict[str, int] = {}
+        # The size of every file some URL points to.
+        self._total = 0
+        self._lock = threading.Lock()
+        self._dirty = False
+        self.load()
+
+    def _blob(self, digest: str) -> Path:
+        return self.blob_path / digest
+
+    def _pin(self, digest: str):
+        """Keep a file from being deleted while it's read or written. Call with the lock held."""
+        self._pins[digest] = self._pins.get(digest, 0) + 1
+
+    def _unpin(self, digest: str):
+        """Call with the lock held."""
+        self._pins[digest] -= 1
+        if not self._pins[digest]:
+            del self._pins[digest]
+            if digest not in self._refs:
+                self._blob(digest).unlink(missing_ok = True)
+
+    def _ref(self, entry: dict):
+        """Count a new index entry's file. Call with the lock held."""
+        digest = entry["hash"]
+        if digest not in self._refs:
+            self._refs[digest] = 0
+            self._total += entry["size"]
+        self._refs[digest] += 1
+
+    def _release(self, entry: dict):
+        """Stop counting an index entry's file, and delete it if nothing uses it anymore. Call with the lock held."""
+        digest = entry["hash"]
+        self._refs[digest] -= 1
+        if not self._refs[digest]:
+            del self._refs[digest]
+            self._total -= entry["size"]
+            if digest not in self._pins:
+                self._blob(digest).unlink(missing_ok = True)
+
+    def _read(self, url: str) -> Tuple[Optional[dict], Optional[bytes]]:
+        """A copy of a URL's entry and its contents, marking it used, or (None, None) if it's not cached."""
+        with self._lock:
+            entry = self._index.get(url)
+            if entry is None:
+                return None, None
+            entry["used"] = time.time()
+            self._dirty = True
+            entry = dict(entry)
+            self._pin(entry["hash"])
+        try:
+            content = self._blob(entry["hash"]).read_bytes()
+        except OSError:
+            return None, None
+        finally:
+            with self._lock:
+                self._unpin(entry["hash"])
+        return entry, content
+
+    def _touch(self, url: str, *, validated: bool = False):
+        with self._lock:
+            # It may have been evicted since it was read, in which case there's nothing to mark.
+            entry = self._index.get(url)
+            if entry is None:
+                return
+            entry["used"] = time.time()
+            if validated:
+                entry["validated"] = entry["used"]
+            self._dirty = True
+
+    def _store(self, url: str, content: bytes, headers):
+        digest = hashlib.sha256(content).hexdigest()
+        blob = self._blob(digest)
+        with self._lock:
+            self._pin(digest)
+        try:
+            # Pinned, so another thread's eviction can't delete the file before it's indexed.
+            if not blob.exists():
+                tmp = blob.with_suffix(f".{threading.get_ident()}.tmp")
+                tmp.write_bytes(content)
+                tmp.replace(blob)
+            now = time.time()
+            entry = {
+                "hash": digest,
+                "size": len(content),
+                "etag": headers.get("ETag"),
+                "last_modified": headers.get("Last-Modified"),
+                "used": now,
+                "validated": now
+            }
+            with self._lock:
+                self._ref(entry)
+                old = self._index.get(url)
+                self._index[url] = entry
+                if old is not None:
+                    self._release(old)
+                self._dirty = True
+                self._evict()
+        finally:
+            with self._lock:
+                self._unpin(digest)
+
+    def _evict(self):
+        """Drop the least recently used URLs until the files fit in maxbytes. Call with the lock held."""
+        if self._total <= self.maxbytes:
+            return
+        for url, entry in sorted(self._index.items(), key = lambda kv: kv[1]["used"]):
+            if self._total <= self.maxbytes or len(self._index) <= 1:
+                break
+            del self._index[url]
+            self._release(entry)
+
+    def get(self, url: str, session: requests.Session, *, timeout: float = None) -> bytes:
+        """Get the contents of a URL, from the cache if they haven't changed."""
+        entry, cached = self._read(url)
+        if cached is not None and time.time() - entry.get("validated", 0) < self.revalidate_after:
+            return cached
+
+        headers = {}
+        if cached is not None:
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        try:
+            r = session.get(url, headers = headers, timeout = timeout)
+        except requests.exceptions.RequestException as e:
+            if cached is not None:
+                logger.warning(f"Couldn't revalidate {url!r}, using the cached copy. ({e.__class__.__name__})")
+                return cached
+            raise DownloadError(f"Image could not be downloaded: {url!r} ({e.__class__.__name__}).")
+
+        if r.status_code == 304 and cached is not None:
+            self._touch(url, validated = True)
+            return cached
+        if r.status_code == 200:
+            self._store(url, r.content, r.headers)
+            return r.content
+        raise DownloadError(f"Image could not be downloaded: {url!r}.")
+
+    def clear(self):
+        with self._lock:
+            for entry in self._index.values():
+                self._release(entry)
+            self._index = {}
+            self._dirty = True
+
+    def load(self):
+        if not self.index_path.exists():
+            return
+        try:
+            with open(self.index_path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            logger.warning(f"Image cache index {self.index_path} is unreadable, starting fresh.")
+            return
+        if data.get("version") != self.version:
+            return
+        self._index = data["entries"]
+        for entry in self._index.values():
+            self._ref(entry)
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            self._evict()
+            tmp = self.index_path.with_suffix(".tmp")
+            with open(tmp, "w") as f:
+                json.dump({"version": self.version, "entries": self._index}, f)
+            tmp.replace(self.index_path)
+            self._dirty = False
+
+    @property
+    def size(self) -> int:
+        """How many bytes the cached files take up."""
+        return self._total
+
+    def __len__(self):
+        return len(self._index)
+
+
+image_cache = ImageCache(cache_dir("avatars"))
+atexit.register(image_cache.save)
@@ -1,28 +1,95 @@
-from decimal import Decimal
 import io
 import importlib.resources as pkg_resources
+import logging
 import math
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from functools import lru_cache
+from typing import Dict, Iterable
 from sizeroyale.lib.units import SV
 
 import requests
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw, ImageFont, UnidentifiedImageError
 from PIL.ImageOps import grayscale
+from requests.adapters import HTTPAdapter
+from tqdm import tqdm
 
 import sizeroyale.data
 from sizeroyale.lib.errors import DownloadError
+from sizeroyale.lib.imagecache import image_cache
 from sizeroyale.lib.utils import chunkList, truncate
 
+logger = logging.getLogger("sizeroyale")
+
 discord_gray = (0x36, 0x39, 0x3F, 255)
 
+download_workers = 8
+download_timeout = 10
+
+session = requests.Session()
+_adapter = HTTPAdapter(pool_connections = download_workers, pool_maxsize = download_workers)
+session.mount("http://", _adapter)
+session.mount("https://", _adapter)
+
+# URLs that couldn't be downloaded during prefetch_images(), and why.
+failed_downloads: Dict[str, Exception] = {}
+
+
+def _open_image(url: str, content: bytes) -> Image.Image:
+    try:
+        return Image.open(io.BytesIO(content))
+    except (UnidentifiedImageError, OSError):
+        raise DownloadError(f"Image could not be read: {url!r}.")
+
 
-@lru_cache(50)
+def _fetch_image(url):
+    """Download an image into image_cache and check that it can be read, without decoding it."""
+    content = image_cache.get(url, session, timeout = download_timeout)
+    try:
+        _open_image(url, content).verify()
+    except (SyntaxError, OSError):
+        # verify() raises SyntaxError for broken PNGs.
+        raise DownloadError(f"Image could not be read: {url!r}.")
+
+
+# The raw files are all in image_cache, so an avatar that falls out of here is just read from disk and decoded again.
+@lru_cache(maxsize = 256)
 def download_image(url):
-    r = requests.get(url, stream=True)
-    if r.status_code == 200:
-        return Image.open(io.BytesIO(r.content))
-    else:
-        raise DownloadError(f"Image could not be downloaded: {url!r}.")
+    i = _open_image(url, image_cache.get(url, session, timeout = download_timeout))
+    try:
+        i.load()
+    except OSError:
+        raise DownloadError(f"Image could not be read: {url!r}.")
+    return i
+
+
+def prefetch_images(urls: Iterable[str], *, workers: int = download_workers) -> Dict[str, Exception]:
+    """Download every image at once using a thread pool, so nothing waits on the network when it's drawn.
+    Images are only downloaded and checked here; they're decoded when they're drawn.
+    Returns the URLs that failed, and why. Those are also logged, and will be drawn with a blank avatar."""
+    urls = [u for u in dict.fromkeys(urls) if u is not None]
+    failures = {}
+    if not urls:
+        return failures
+    with ThreadPoolExecutor(max_workers = workers) as executor:
+        futures = {executor.submit(_fetch_image, url): url for url in urls}
+        for future in tqdm(as_completed(futures), total = len(futures), desc = "Downloading avatars..."):
+            url = futures[future]
+            try:
+                future.result()
+            except DownloadError as e:
+                logger.error(e.message)
+                failures[url] = e
+    failed_downloads.update(failures)
+    image_cache.save()
+    logger.info(f"Downloaded {len(urls) - len(failures)}/{len(urls)} avatars.")
+    return failures
+
+
+def get_avatar(url) -> Image.Image:
+    """Get a player's avatar, or a blank one if they don't have one that works."""
+    if url is None or url in failed_downloads:
+        return Image.new("RGBA", (1, 1), discord_gray)
+    return download_image(url)
 
 
 # https://note.nkmk.me/en/python-pillow-square-circle-thumbnail/
@@ -74,45 +141,108 @@ def merge_images_vertical(images: list) -> Image.Image:
     return result
 
 
-@lru_cache(maxsize = 50)
-def create_profile_picture(system: str, url: str, name: str, team, height: Decimal, dead: bool):
-    px = 200
-    size = (px, px)
+card_size = (200, 200)
+
+# Fonts are referred to by (filename in sizeroyale.data, size), so they can be used as cache keys.
+name_font = ("Roobert-SemiBold.otf", 20)
+team_font = ("Roobert-RegularItalic.otf", 14)
+height_font = ("Roobert-Regular.otf", 14)
+
+
+@lru_cache(maxsize = None)
+def load_font(filename: str, size: int) -> ImageFont.FreeTypeFont:
+    """Load a font from sizeroyale.data. Each font is only loaded once per process."""
+    with pkg_resources.path(sizeroyale.data, filename) as p:
+        return ImageFont.truetype(str(p.absolute()), size = size)
+
+
+@lru_cache(maxsize = 4096)
+def text_length(font: tuple, text: str) -> float:
+    return load_font(*font).getlength(text)
 
-    raw_image = download_image(url)
-    height_text = SV.format(height, system)
 
-    i = raw_image.convert("RGBA")
+@lru_cache(maxsize = 4096)
+def text_bbox(font: tuple, text: str) -> tuple:
+    return load_font(*font).getbbox(text)
+
+
+@lru_cache(maxsize = 1024)
+def fit_text(font: tuple, text: str, width: int) -> str:
+    """Truncate text until it fits in `width` pixels, using a binary search on its length."""
+    if text_length(font, text) <= width:
+        return text
+    # The longest truncation that fits. truncate(text, 3) is just "...".
+    low, high = 3, len(text) - 1
+    while low < high:
+        mid = (low + high + 1) // 2
+        if text_length(font, truncate(text, mid)) <= width:
+            low = mid
+        else:
+            high = mid - 1
+    return truncate(text, low)
+
+
+@lru_cache(maxsize = 256)
+def avatar_base(url: str) -> Image.Image:
+    """A player's avatar, cropped square and resized onto the card background."""
+    i = get_avatar(url).convert("RGBA")
     i = crop_max_square(i)
-    i = i.resize(size)
-    rgbimg = Image.new("RGBA", i.size)
-    rgbimg.paste(discord_gray, (0, 0, px, px))
-    rgbimg.paste(i, (0, 0), i)
-    i = rgbimg
-    d = ImageDraw.Draw(i)
-    with pkg_resources.path(sizeroyale.data, "Roobert-SemiBold.otf") as p:
-        fnt_semibold = ImageFont.truetype(str(p.absolute()), size = 20)
-    with pkg_resources.path(sizeroyale.data, "Roobert-RegularItalic.otf") as p:
-        fnt_italic = ImageFont.truetype(str(p.absolute()), size = 14)
-    with pkg_resources.path(sizeroyale.data, "Roobert-Regular.otf") as p:
-        fnt = ImageFont.truetype(str(p.absolute()), size = 14)
-    tname = name
-    while fnt_semibold.getlength(name) > i.width:
-        tname = truncate(name, len(name) - 1)
-    _, _, textwidth, textheight = fnt_semibold.getbbox(name)
-    d.text(((i.width - textwidth) // 2, i.height - textheight - 20),
-           tname, align = "center", font = fnt_semibold, fill = (0, 0, 0),
-           stroke_width = 2, stroke_fill = (255, 255, 255))
-    d.text((10, 10),
-           team, align = "center", font = fnt_italic, fill = (0, 0, 0),
-           stroke_width = 2, stroke_fill = (255, 255, 255))
-    d.text(((i.width - textwidth) // 2, i.height - textheight + 3),
-           height_text, align = "center", font = fnt, fill = (0, 0, 0),
-           stroke_width = 2, stroke_fill = (255, 255, 255))
+    i = i.resize(card_size)
+    base = Image.new("RGBA", card_size, discord_gray)
+    # Pasted with itself as the mask, not alpha composited, so partly transparent avatars
+    # leave the card partly transparent too, the way cards have always been drawn.
+    base.paste(i, (0, 0), i)
+    return base
+
 
+@lru_cache(maxsize = 1024)
+def text_layer(font: tuple, text: str) -> tuple:
+    """The outline and fill masks of outlined text, on strips that fit it exactly.
+    Returns the two masks, and where their corner is relative to where the text was drawn."""
+    left, top, right, bottom = ImageDraw.Draw(Image.new("L", (1, 1))).textbbox((0, 0), text, font = load_font(*font), stroke_width = 2)
+    size = (max(right - left, 1), max(bottom - top, 1))
+    outline = Image.new("L", size)
+    ImageDraw.Draw(outline).text((-left, -top), text, align = "center", font = load_font(*font), fill = 255,
+                                 stroke_width = 2, stroke_fill = 255)
+    fill = Image.new("L", size)
+    ImageDraw.Draw(fill).text((-left, -top), text, align = "center", font = load_font(*font), fill = 255)
+    return outline, fill, left, top
+
+
+def paste_layer(image: Image.Image, layer: tuple, x: int, y: int):
+    """Paste a text_layer() onto an image in place, exactly as if the text was drawn at (x, y):
+    a white outline, then black text over it."""
+    outline, fill, left, top = layer
+    x, y = x + left, y + top
+    image.paste((255, 255, 255, 255), (x, y, x + outline.width, y + outline.height), outline)
+    image.paste((0, 0, 0, 255), (x, y, x + fill.width, y + fill.height), fill)
+
+
+@lru_cache(maxsize = 256)
+def name_layout(name: str) -> tuple:
+    """The name as it fits on a card, and its width and height."""
+    tname = fit_text(name_font, name, card_size[0])
+    _, _, textwidth, textheight = text_bbox(name_font, tname)
+    return tname, textwidth, textheight
+
+
+@lru_cache(maxsize = 256)
+def create_live_card(url: str, name: str, team, height_text: str) -> Image.Image:
+    """A card built from the cached avatar and text masks, so a new height only has to draw its label."""
+    px, py = card_size
+    tname, textwidth, textheight = name_layout(name)
+    i = avatar_base(url).copy()
+    paste_layer(i, text_layer(name_font, tname), (px - textwidth) // 2, py - textheight - 20)
+    paste_layer(i, text_layer(team_font, team), 10, 10)
+    paste_layer(i, text_layer(height_font, height_text), (px - textwidth) // 2, py - textheight + 3)
+    return i
+
+
+@lru_cache(maxsize = 256)
+def create_profile_picture(url: str, name: str, team, height_text: str, dead: bool):
+    i = create_live_card(url, name, team, height_text)
     if dead:
         i = kill(i)
-
     return i
 
 
@@ -130,10 +260,101 @@ def kill(image: Image, *, gray: bool = True, x: bool = True, color = (255, 0, 0)
     return i
 
 
-def create_stats_screen(players) -> Image.Image:
-    image_list = [p.image for p in sorted(players.values())]
-    height = math.ceil(math.sqrt(len(image_list)))
+def create_cards_image(cards: list, system: str = "m") -> Image.Image:
+    """Merge the cards of a list of Player.card tuples into one image."""
+    height_texts = SV.format_many([height for _, _, _, height, _ in cards], system)
+    return merge_images([create_profile_picture(url, name, team, t, dead)
+                         for (url, name, team, _, dead), t in zip(cards, height_texts)])
+
+
+class LazyImage:
+    """An image that isn't drawn until something asks for it, and is only drawn once."""
+    def __init__(self, render, *args):
+        self._render = render
+        self._args = args
+        self._image = None
+
+    @property
+    def rendered(self) -> bool:
+        return self._render is None
+
+    def render(self) -> Image.Image:
+        if self._render is not None:
+            self._image = self._render(*self._args)
+            self._render = None
+            self._args = None
+        return self._image
+
+    def __repr__(self):
+        return f"LazyImage(rendered={self.rendered!r})"
+
+
+class StatsScreen:
+    """
+    A stats screen that keeps its canvas between updates, and only repastes
+    the tiles of players that were marked as changed since the last one.
+    The layout (sorted by team, then name) is only rebuilt if the players or teams change.
+    update() returns the same Image every time, drawn over in place.
+    """
+    def __init__(self, players: dict, system: str = "m"):
+        self.players = players
+        self.system = system
+        self.image = None
+        self._positions = {}
+        self._drawn = {}
+        # None means every player needs to be checked.
+        self._dirty = None
+
+    def mark(self, *players):
+        """Mark players whose height, death or team might have changed."""
+        if self._dirty is not None:
+            self._dirty.update(p.name for p in players)
+
+    def invalidate(self):
+        """Check every player on the next update, for changes made without mark()."""
+        self._dirty = None
+
+    def _layout(self):
+        """Place every player's tile the same way merge_images() and merge_images_vertical() would."""
+        order = sorted(self.players.values())
+        tw, th = card_size
+        columns = math.ceil(math.sqrt(len(order)))
+        rows = list(chunkList(order, columns))
+        width = max(len(r) for r in rows) * tw
+        self.image = Image.new("RGBA", (width, len(rows) * th))
+        self._positions = {}
+        for y, row in enumerate(rows):
+            # The last row is centered.
+            x_offset = (width - len(row) * tw) // 2 if y == len(rows) - 1 else 0
+            for x, p in enumerate(row):
+                self._positions[p.name] = (x_offset + x * tw, y * th)
+        self._drawn = {}
+
+    def _state(self, p) -> tuple:
+        return (p.height, p.dead, p.team, p.url)
+
+    def update(self) -> Image.Image:
+        if not self.players:
+            return Image.new("RGBA", (1, 1))
+        if self._dirty is None:
+            if self.image is None or self._positions.keys() != self.players.keys():
+                self._layout()
+            candidates = self.players.values()
+        else:
+            candidates = [self.players[n] for n in self._dirty]
+        changed = [p for p in candidates if self._drawn.get(p.name) != self._state(p)]
+        if any(p.name in self._drawn and self._drawn[p.name][2] != p.team for p in changed):
+            # Teams decide the order, so everything moves.
+            self._layout()
+            changed = list(self.players.values())
+        if changed:
+            height_texts = SV.format_many([p.height for p in changed], self.system)
+            for p, t in zip(changed, height_texts):
+                self.image.paste(create_profile_picture(p.url, p.name, p.team, t, p.dead), self._positions[p.name])
+                self._drawn[p.name] = self._state(p)
+        self._dirty = set()
+        return self.image
 
-    images = [merge_images(chunk) for chunk in chunkList(image_list, height)]
 
-    return merge_images_vertical(images)
+def create_stats_screen(players, system: str = "m") -> Image.Image:
+    return StatsScreen(players, system).update()
@@ -0,0 +1,164 @@
+"""
+Run many headless games of one spec across a process pool, and aggregate how they went.
+The spec is parsed once, and each worker process gets its own copy of the parsed game.
+Every game only depends on its seed, so the same seed list always gives the same results.
+"""
+
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, List
+
+from sizeroyale.lib.classes.eventrecord import EventRecord
+from sizeroyale.lib.classes.game import Game
+
+# z for a 95% confidence interval.
+Z = 1.96
+
+# The parsed game each worker process reuses.
+_game = None
+
+
+def _init_worker(game: Game):
+    global _game
+    _game = game
+
+
+def play(game: Game, seed) -> dict:
+    """Play one game to the end from a fresh start, and summarize it."""
+    game.reset(seed)
+    royale = game.royale
+    alive = set(royale.alive_players)
+    placements = {}
+    rounds = 0
+    while game.game_over is None:
+        result = game.next()
+        if not isinstance(result, EventRecord):
+            rounds += 1
+        now_alive = set(royale.alive_players)
+        # Players who go out together tie, one place behind everyone still in.
+        for name in alive - now_alive:
+            placements[name] = len(now_alive) + 1
+        alive = now_alive
+        if result is None:
+            break
+    for name in alive:
+        placements[name] = 1
+
+    winner = game.game_over
+    if winner is None or winner == 0:
+        winning_team = None
+        winners = []
+    elif royale.teamwin:
+        winning_team = winner
+        winners = [n for n, p in royale.players.items() if p.team == winner]
+    else:
+        winning_team = winner[1].team
+        winners = [winner[0]]
+
+    return {
+        "seed": seed,
+        "winners": winners,
+        "winning_team": winning_team,
+        "placements": placements,
+        "elims": {n: p.elims for n, p in royale.players.items()},
+        "rounds": rounds,
+        "days": game.current_day
+    }
+
+
+def _play_worker(seed) -> dict:
+    return play(_game, seed)
+
+
+def proportion_interval(hits: int, n: int) -> tuple:
+    """The Wilson score interval of a proportion."""
+    if n == 0:
+        return (0.0, 0.0)
+    p = hits / n
+    denominator = 1 + Z ** 2 / n
+    center = (p + Z ** 2 / (2 * n)) / denominator
+    spread = Z * math.sqrt(p * (1 - p) / n + Z ** 2 / (4 * n ** 2)) / denominator
+    return (max(0.0, center - spread), min(1.0, center + spread))
+
+
+def mean_interval(values: list) -> tuple:
+    """The mean of some values, and the half-width of its normal confidence interval."""
+    n = len(values)
+    if n == 0:
+        return (0.0, 0.0)
+    mean = sum(values) / n
+    if n == 1:
+        return (mean, 0.0)
+    variance = sum((v - mean) ** 2 for v in values) / (n - 1)
+    return (mean, Z * math.sqrt(variance / n))
+
+
+class MonteCarloResults:
+    def __init__(self, players: dict):
+        self.players = {n: p.team for n, p in players.items()}
+        self.teams = list(dict.fromkeys(self.players.values()))
+        self.games = []
+
+    def add(self, result: dict):
+        self.games.append(result)
+
+    @property
+    def count(self) -> int:
+        return len(self.games)
+
+    def player_wins(self, name: str) -> int:
+        return sum(name in g["winners"] for g in self.games)
+
+    def team_wins(self, team) -> int:
+        return sum(g["winning_team"] == team for g in self.games)
+
+    @property
+    def draws(self) -> int:
+        return sum(g["winning_team"] is None for g in self.games)
+
+    def report(self) -> str:
+        n = self.count
+        if n == 0:
+            return "0 games, so nothing to report."
+        lines = [f"{n} games, {self.draws} with no winner. (95% confidence intervals)", ""]
+
+        lines.append("Players:")
+        lines.append(f"  {'Name':<24} {'Team':>6} {'Win rate':>22} {'Mean place':>16} {'Mean elims':>16}")
+        for name, team in sorted(self.players.items(), key = lambda kv: -self.player_wins(kv[0])):
+            wins = self.player_wins(name)
+            low, high = proportion_interval(wins, n)
+            place, place_ci = mean_interval([g["placements"][name] for g in self.games])
+            elims, elims_ci = mean_interval([g["elims"][name] for g in self.games])
+            lines.append(f"  {name:<24} {str(team):>6} {wins / n:>7.1%} [{low:.1%}, {high:.1%}]"
+                         f" {place:>8.2f} ±{place_ci:.2f} {elims:>8.2f} ±{elims_ci:.2f}")
+
+        lines.append("")
+        lines.append("Teams:")
+        for team in sorted(self.teams, key = lambda t: -self.team_wins(t)):
+            wins = self.team_wins(team)
+            low, high = proportion_interval(wins, n)
+            lines.append(f"  Team {str(team):<19} {wins / n:>14.1%} [{low:.1%}, {high:.1%}]")
+
+        lines.append("")
+        rounds, rounds_ci = mean_interval([g["rounds"] for g in self.games])
+        days, days_ci = mean_interval([g["days"] for g in self.games])
+        lines.append(f"Game length: {rounds:.2f} ±{rounds_ci:.2f} rounds, {days:.2f} ±{days_ci:.2f} days.")
+        return "\n".join(lines)
+
+
+def run(spec, seeds: Iterable, *, workers: int = None) -> MonteCarloResults:
+    """Parse a spec once, and play a game for every seed across a pool of worker processes."""
+    seeds: List = list(seeds)
+    game = Game(spec, headless = True)
+    results = MonteCarloResults(game.royale.players)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        for seed in seeds:
+            results.add(play(game, seed))
+        return results
+    chunksize = max(1, len(seeds) // (workers * 8))
+    with ProcessPoolExecutor(max_workers = workers, initializer = _init_worker, initargs = (game,)) as executor:
+        for result in executor.map(_play_worker, seeds, chunksize = chunksize):
+            results.add(result)
+    return results
@@ -0,0 +1,312 @@
+"""
+Record games as a compact log of what happened in each round, and play them back
+without simulating anything: no sampling, matching or unit parsing, just the spec's
+event texts filled in and each player's recorded state after every event.
+
+The log is JSON lines. The first line is a header, and every line after it is
+a round or a round of cannon shots. "spec_sha256" is the hash of the spec file, and
+"units" the unit backend it was parsed with:
+    {"replay": 2, "spec": "/abs/path", "spec_sha256": "<sha256>", "units": "local", "seed": "...", "players": ["name", ...]}
+    {"round": "day", "day": 1, "arena": null, "shown": true,
+     "events": [[["day", 12], ["name", ...], {"name": [height, attributes, inventory, dead, elims]}], ...]}
+    {"cannon": ["name", ...]}
+Event ids are ["<type>", index] into the spec's events of that type, or ["arena", arena index, index].
+
+Every K rounds, a GameSnapshot can also be written to a checkpoint file next to the log,
+so that seeking only replays the rounds since the last checkpoint:
+    {"checkpoints": 2, "replay": 2, "seed": "...", "every": K}
+    {"round":10,"offset":12345,"state":{...GameSnapshot.dump()...}}
+"offset" is where the log's next line starts. A checkpoint file in any other format,
+or for a game with another seed, is ignored, and seeking falls back to replaying the log from the start.
+"""
+
+import json
+import logging
+import os
+from bisect import bisect_left, bisect_right
+from decimal import Decimal
+from typing import IO, Iterator, List, Optional, Union
+
+from sizeroyale.lib import units
+from sizeroyale.lib.classes.eventrecord import EventRecord
+from sizeroyale.lib.classes.player import Player
+from sizeroyale.lib.classes.snapshot import GameSnapshot
+from sizeroyale.lib.errors import GametimeError
+from sizeroyale.lib.img_utils import StatsScreen
+from sizeroyale.lib.listdict import ListDict
+from sizeroyale.lib.speccache import file_sha256, spec_cache
+
+logger = logging.getLogger("sizeroyale")
+
+# Bump these when the log or checkpoint formats change.
+FORMAT_VERSION = 2
+CHECKPOINT_VERSION = 2
+
+
+def _dumps(record) -> bytes:
+    return json.dumps(record, separators = (",", ":")).encode("utf-8") + b"\n"
+
+
+def _state(player: Player) -> list:
+    height, attributes, inventory, dead, elims = player.snapshot()
+    return [str(height), list(attributes), list(inventory), dead, elims]
+
+
+def checkpoint_path(path) -> str:
+    """Where the checkpoints for a replay log go."""
+    return f"{path}.checkpoints"
+
+
+class ReplayWriter:
+    """Writes the replay log of a game. Pass one to Game(replay = ...), and close it when you're done.
+    With `checkpoint_every`, a checkpoint is written every that many rounds, to `checkpoints`
+    (by default, checkpoint_path() of the log.) Resetting the game starts both over."""
+    def __init__(self, file: Union[str, IO[bytes]], *, checkpoint_every: int = None,
+                 checkpoints: Union[str, IO[bytes]] = None):
+        self._own = isinstance(file, str)
+        self._file = open(file, "wb") if self._own else file
+        self._start = self._file.tell()
+        self.checkpoint_every = checkpoint_every
+        if checkpoint_every is None:
+            self._checkpoints = None
+            if self._own:
+                # Checkpoints left over from an earlier log at this path don't go with this one.
+                try:
+                    os.remove(checkpoint_path(file))
+                except FileNotFoundError:
+                    pass
+        else:
+            if checkpoints is None:
+                if not self._own:
+                    raise ValueError("Checkpoints need a file to go in, if the log isn't a path.")
+                checkpoints = checkpoint_path(file)
+            self._own_checkpoints = isinstance(checkpoints, str)
+            self._checkpoints = open(checkpoints, "wb") if self._own_checkpoints else checkpoints
+            self._checkpoints_start = self._checkpoints.tell()
+        self._rounds = 0
+
+    def start(self, game):
+        self._file.seek(self._start)
+        self._file.truncate()
+        self._file.write(_dumps({
+            "replay": FORMAT_VERSION,
+            "spec": os.path.abspath(game.royale._file),
+            "spec_sha256": file_sha256(game.royale._file),
+            "units": units.SV.backend.name,
+            "seed": game.seed,
+            "players": list(game.royale.players)
+        }))
+        self._rounds = 0
+        if self._checkpoints is not None:
+            self._checkpoints.seek(self._checkpoints_start)
+            self._checkpoints.truncate()
+            self._checkpoints.write(_dumps({
+                "checkpoints": CHECKPOINT_VERSION,
+                "replay": FORMAT_VERSION,
+                "seed": game.seed,
+                "every": self.checkpoint_every
+            }))
+            self._checkpoint(game)
+
+    def _checkpoint(self, game):
+        # The round number comes first and on its own, so Replay can find it without parsing the rest.
+        self._checkpoints.write(f"{{\"round\":{self._rounds},\"offset\":{self._file.tell()},\"state\":".encode("utf-8")
+                                + json.dumps(game.snapshot().dump(), separators = (",", ":")).encode("utf-8") + b"}\n")
+
+    def round(self, game, events: List[dict], shown: bool):
+        """Log a round's events. Rounds cut short by the end of the game aren't shown, but still change players."""
+        arena = game.royale.arenas.index(game.current_arena) if game.current_event_type == "arena" else None
+        players = game.royale.players
+        self._file.write(_dumps({
+            "round": game.current_event_type,
+            "day": game.current_day,
+            "arena": arena,
+            "shown": shown,
+            "events": [[e["event"], list(e["players"]), {n: _state(players[n]) for n in e["players"]}] for e in events]
+        }))
+        self._rounds += 1
+        if self._checkpoints is not None and self._rounds % self.checkpoint_every == 0:
+            self._checkpoint(game)
+
+    def cannon(self, deaths: List[Player]):
+        self._file.write(_dumps({"cannon": [p.name for p in deaths]}))
+
+    def flush(self):
+        self._file.flush()
+        if self._checkpoints is not None:
+            self._checkpoints.flush()
+
+    def close(self):
+        self.flush()
+        if self._own:
+            self._file.close()
+        if self._checkpoints is not None and self._own_checkpoints:
+            self._checkpoints.close()
+
+
+class Replay:
+    """
+    Plays back a replay log. Iterating over it gives (round type, day, result) from the current
+    position, where result is what Game.next() gave, without images. seek() jumps to the start of any round,
+    from the last checkpoint before it if there's a checkpoint file.
+    The spec is only parsed if it's not already in the spec cache. It has to be the same spec
+    the log was written from, with the same unit backend.
+    """
+    def __init__(self, path, spec = None, *, checkpoints = None):
+        self._path = path
+        self._f = open(path, "rb")
+        header = json.loads(self._f.readline())
+        if header.get("replay") != FORMAT_VERSION:
+            raise GametimeError(f"Replay log {path} is format {header.get('replay')!r}, not {FORMAT_VERSION}.")
+        self.seed = header["seed"]
+        if spec is None:
+            spec = header["spec"]
+            if not os.path.exists(spec):
+                raise GametimeError(f"Replay log {path} was written from {spec}, which doesn't exist. Pass the spec to play it with.")
+        if file_sha256(spec) != header["spec_sha256"]:
+            raise GametimeError(f"Replay log {path} wasn't written from {spec} as it is now. The spec has changed since.")
+        if units.SV.backend.name != header["units"]:
+            raise GametimeError(f"Replay log {path} was written with the {header['units']!r} unit backend, "
+                                f"not {units.SV.backend.name!r}.")
+        self.spec = spec_cache.get(spec)
+        self.players = self.spec.create_players(None)
+        if list(self.players) != header["players"]:
+            raise GametimeError(f"Replay log {path} doesn't match the players in its spec.")
+        # Where every round and cannon line starts, and which of them are rounds.
+        self._offsets = []
+        self._rounds = []
+        while (line := self._f.readline()):
+            if line.startswith(b"{\"round\""):
+                self._rounds.append(len(self._offsets))
+            self._offsets.append(self._f.tell() - len(line))
+        self._checkpoints = None
+        # (round, where its line starts in the checkpoint file), in order.
+        self._checkpoint_index = []
+        self._load_checkpoints(checkpoint_path(path) if checkpoints is None else checkpoints)
+        self._stats_screen = None
+        self.seek(0)
+
+    def _load_checkpoints(self, path):
+        if not os.path.exists(path):
+            return
+        f = open(path, "rb")
+        try:
+            header = json.loads(f.readline())
+        except ValueError:
+            header = {}
+        if header.get("checkpoints") != CHECKPOINT_VERSION or header.get("replay") != FORMAT_VERSION:
+            logger.warning(f"Ignoring checkpoints {path}, which are in another format.")
+            f.close()
+            return
+        if header.get("seed") != self.seed:
+            logger.warning(f"Ignoring checkpoints {path}, which are from another game.")
+            f.close()
+            return
+        self._checkpoints = f
+        prefix = b"{\"round\":"
+        while (line := f.readline()):
+            # A checkpoint cut off partway through being written is no use.
+            if not line.startswith(prefix) or not line.endswith(b"\n"):
+                break
+            self._checkpoint_index.append((int(line[len(prefix):line.index(b",")]), f.tell() - len(line)))
+
+    @property
+    def round_count(self) -> int:
+        return len(self._rounds)
+
+    def _event(self, event_id: list):
+        if event_id[0] == "arena":
+            return self.spec.arenas[event_id[1]].events[event_id[2]]
+        return getattr(self.spec, event_id[0] + "_events")[event_id[1]]
+
+    def _read(self, n: int) -> dict:
+        self._f.seek(self._offsets[n])
+        return json.loads(self._f.readline())
+
+    def _apply(self, record: dict, *, text: bool) -> Optional[list]:
+        """Bring the players up to date with a record, and rebuild what Game.next() returned for it if `text`."""
+        if "cannon" in record:
+            deaths = [self.players[n] for n in record["cannon"]]
+            if not text:
+                return None
+            return EventRecord(f"{len(deaths)} cannon shot{'' if len(deaths) == 1 else 's'} sound through the arena.",
+                               deaths = deaths, kind = "cannon")
+        events = []
+        for event_id, names, states in record["events"]:
+            players = ListDict((n, self.players[n]) for n in names)
+            if text:
+                eventtext = self._event(event_id).fillin(players)
+            for n, (height, attributes, inventory, dead, elims) in states.items():
+                self.players[n].restore((Decimal(height), attributes, inventory, dead, elims))
+            if text:
+                # Everyone in an event was alive going in, so anyone dead coming out died in it.
+                events.append(EventRecord(eventtext, players = players, deaths = [self.players[n] for n in names if states[n][3]]))
+        if not text or not record["shown"]:
+            return None
+        return events
+
+    def checkpoint(self, round: int) -> Optional[tuple]:
+        """The round and GameSnapshot of the last checkpoint at or before a round, and where the log
+        goes on from it, or None if there isn't one. Game.restore() can carry on playing from the snapshot."""
+        i = bisect_right(self._checkpoint_index, (round, float("inf"))) - 1
+        if i < 0:
+            return None
+        self._checkpoints.seek(self._checkpoint_index[i][1])
+        data = json.loads(self._checkpoints.readline())
+        return data["round"], GameSnapshot.load(data["state"]), data["offset"]
+
+    def seek(self, round: int):
+        """Put every player the way they were at the start of a round, counting from 0."""
+        if not 0 <= round <= len(self._rounds):
+            raise IndexError(f"Replay has no round {round}.")
+        start = 0
+        checkpoint = self.checkpoint(round)
+        if checkpoint is not None:
+            _, snapshot, offset = checkpoint
+            for name, state in snapshot.players.items():
+                self.players[name].restore(state)
+            start = bisect_left(self._offsets, offset)
+        else:
+            for p in self.players.values():
+                p.reset()
+        stop = len(self._offsets) if round == len(self._rounds) else self._rounds[round]
+        for n in range(start, stop):
+            self._apply(self._read(n), text = False)
+        self._position = stop
+
+    @property
+    def stats_screen(self):
+        """The stats screen as of the current position."""
+        if self._stats_screen is None:
+            self._stats_screen = StatsScreen(self.players, "m" if self.spec.unitsystem is None else self.spec.unitsystem)
+        # Players change without being marked as the replay moves, so check them all.
+        self._stats_screen.invalidate()
+        return self._stats_screen.update()
+
+    def __iter__(self) -> Iterator[tuple]:
+        while self._position < len(self._offsets):
+            record = self._read(self._position)
+            self._position += 1
+            result = self._apply(record, text = True)
+            if result is not None:
+                yield record.get("round"), record.get("day"), result
+
+    def transcript(self) -> list:
+        """The whole game's transcript, the same as Game.simulate() gave."""
+        self.seek(0)
+        transcript = []
+        for round_type, day, result in self:
+            if isinstance(result, EventRecord):
+                transcript.append(result.text)
+                continue
+            transcript.append(f"[{round_type.capitalize()}, Day {day}]")
+            transcript.extend(r.text for r in result)
+        return transcript
+
+    def close(self):
+        self._f.close()
+        if self._checkpoints is not None:
+            self._checkpoints.close()
+
+    def __repr__(self):
+        return f"Replay(path={self._path!r}, seed={self.seed!r}, rounds={len(self._rounds)})"
@@ -0,0 +1,127 @@
+import hashlib
+import logging
+import pickle
+import threading
+from pathlib import Path
+from typing import Dict, Optional
+
+import sizeroyale
+from sizeroyale.lib import units
+from sizeroyale.lib.cachedir import cache_dir
+from sizeroyale.lib.classes.parser import Parser, event_headers
+from sizeroyale.lib.classes.player import Player
+from sizeroyale.lib.units import SV
+
+logger = logging.getLogger("sizeroyale")
+
+
+def file_sha256(path, prefix: bytes = b"") -> str:
+    """Hash a file a block at a time, so big files aren't read into memory to do it."""
+    digest = hashlib.sha256(prefix)
+    with open(path, "rb") as f:
+        while (block := f.read(1024 * 1024)):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class CompiledSpec:
+    """
+    Everything parsed out of a spec, with its units already resolved.
+    Events and arenas don't change during a game, so every game made from the same
+    spec shares them. Players do change, so each game gets its own copies.
+    """
+    def __init__(self, parser: Parser):
+        self.autoelim = parser.autoelim
+        self.teamwin = parser.teamwin
+        self.deathrate = parser.deathrate
+        self.arenafreq = parser.arenafreq
+        self.unitsystem = parser.unitsystem
+        self.minsize = None if parser.minsize is None else SV.parse(parser.minsize)
+        self.maxsize = None if parser.maxsize is None else SV.parse(parser.maxsize)
+        self.errors = list(parser.errors)
+        self.arenas = parser.arenas
+        for header in event_headers:
+            setattr(self, header + "_events", getattr(parser, header + "_events"))
+        # Players are kept pickled, so each game can unpickle a fresh set.
+        for p in parser.players.values():
+            p._game = None
+        self._players = pickle.dumps(parser.players, pickle.HIGHEST_PROTOCOL)
+
+    def create_players(self, game) -> Dict[str, Player]:
+        """A new copy of the players, belonging to a game."""
+        players = pickle.loads(self._players)
+        for p in players.values():
+            p._game = game
+        return players
+
+
+class SpecCache:
+    """
+    Compiled specs, keyed by the SHA-256 of the spec file, the engine version, the unit backend
+    and whether debug logging is on (events and players only keep their metadata when it is.)
+    Specs are kept in memory for the life of the process, and pickled to disk so
+    later runs don't parse them again.
+    Bump `version` whenever a change to parsing would change what a spec compiles to.
+    """
+    version = 4
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.mkdir(parents = True, exist_ok = True)
+        self._compiled: Dict[str, CompiledSpec] = {}
+        self._lock = threading.Lock()
+
+    def key(self, path) -> str:
+        debug = logger.isEnabledFor(logging.DEBUG)
+        return file_sha256(path, f"{sizeroyale.__version__}:{self.version}:{units.SV.backend.name}:{debug}\n".encode("utf-8"))
+
+    def _file(self, key: str) -> Path:
+        return self.path / f"{key}.pickle"
+
+    def _load(self, key: str) -> Optional[CompiledSpec]:
+        try:
+            with open(self._file(key), "rb") as f:
+                spec = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            # Anything from a truncated file to a class that's moved since; parsing again fixes it.
+            logger.warning(f"Compiled spec {key} is unreadable, parsing again. ({e.__class__.__name__})")
+            return None
+        return spec if isinstance(spec, CompiledSpec) else None
+
+    def _store(self, key: str, spec: CompiledSpec):
+        tmp = self._file(key).with_suffix(f".{threading.get_ident()}.tmp")
+        try:
+            with open(tmp, "wb") as f:
+                pickle.dump(spec, f, pickle.HIGHEST_PROTOCOL)
+            tmp.replace(self._file(key))
+        except OSError as e:
+            logger.warning(f"Couldn't save compiled spec {key}. ({e.__class__.__name__})")
+
+    def get(self, path, game = None) -> CompiledSpec:
+        """Get the compiled form of a spec file, parsing it only if it's not cached."""
+        if not units.SV.cacheable:
+            # Recording units means parsing every one of them, so don't use (or fill) the cache.
+            with open(path) as f:
+                return CompiledSpec(Parser(game, f))
+        key = self.key(path)
+        with self._lock:
+            if key in self._compiled:
+                return self._compiled[key]
+            spec = self._load(key)
+            if spec is None:
+                with open(path) as f:
+                    spec = CompiledSpec(Parser(game, f))
+                self._store(key, spec)
+            self._compiled[key] = spec
+            return spec
+
+    def clear(self):
+        with self._lock:
+            self._compiled = {}
+            for f in self.path.glob("*.pickle"):
+                f.unlink(missing_ok = True)
+
+
+spec_cache = SpecCache(cache_dir("specs"))
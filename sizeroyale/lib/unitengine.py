@@ -0,0 +1,191 @@
+"""
+An in-process replacement for the SizeBot unit API.
+
+Only the unit types the royale actually uses are supported:
+SV (lengths, stored as meters), and Diff (add/multiply changes to a length).
+Lengths can be formatted in the "m" (metric), "u" (US) and "o" (objects) systems.
+"""
+
+import re
+from decimal import Decimal, InvalidOperation
+
+from sizeroyale.lib.attrdict import AttrDict
+from sizeroyale.lib.errors import ParseError
+
+INCH = Decimal("0.0254")
+FOOT = INCH * 12
+MILE = FOOT * 5280
+
+# Every accepted spelling of a length unit, and its size in meters.
+length_units = {
+    "nm": Decimal("1e-9"), "nanometer": Decimal("1e-9"), "nanometre": Decimal("1e-9"),
+    "µm": Decimal("1e-6"), "um": Decimal("1e-6"), "micrometer": Decimal("1e-6"), "micrometre": Decimal("1e-6"), "micron": Decimal("1e-6"),
+    "mm": Decimal("0.001"), "millimeter": Decimal("0.001"), "millimetre": Decimal("0.001"),
+    "cm": Decimal("0.01"), "centimeter": Decimal("0.01"), "centimetre": Decimal("0.01"),
+    "dm": Decimal("0.1"), "decimeter": Decimal("0.1"), "decimetre": Decimal("0.1"),
+    "m": Decimal("1"), "meter": Decimal("1"), "metre": Decimal("1"),
+    "km": Decimal("1000"), "kilometer": Decimal("1000"), "kilometre": Decimal("1000"),
+    "au": Decimal("149597870700"),
+    "ly": Decimal("9460730472580800"), "lightyear": Decimal("9460730472580800"), "light-year": Decimal("9460730472580800"),
+    "in": INCH, "inch": INCH, "inches": INCH, "\"": INCH, "″": INCH,
+    "ft": FOOT, "foot": FOOT, "feet": FOOT, "'": FOOT, "′": FOOT,
+    "yd": FOOT * 3, "yard": FOOT * 3,
+    "mi": MILE, "mile": MILE
+}
+
+# Units that are displayed by the metric system, largest first.
+metric_display = [
+    (Decimal("9460730472580800"), "ly"),
+    (Decimal("149597870700"), "AU"),
+    (Decimal("1000"), "km"),
+    (Decimal("1"), "m"),
+    (Decimal("0.01"), "cm"),
+    (Decimal("0.001"), "mm"),
+    (Decimal("1e-6"), "µm"),
+    (Decimal("1e-9"), "nm")
+]
+
+# Things to compare a length to in the objects system, largest first.
+objects_display = [
+    (Decimal("1392700000"), "Sun", "Suns"),
+    (Decimal("12742000"), "Earth", "Earths"),
+    (Decimal("8848.86"), "Mount Everest", "Mount Everests"),
+    (Decimal("330"), "Eiffel Tower", "Eiffel Towers"),
+    (Decimal("93"), "Statue of Liberty", "Statues of Liberty"),
+    (Decimal("10"), "house", "houses"),
+    (Decimal("4.5"), "car", "cars"),
+    (Decimal("1.7"), "person", "people"),
+    (Decimal("0.18"), "banana", "bananas"),
+    (Decimal("0.0856"), "credit card", "credit cards"),
+    (Decimal("0.01905"), "penny", "pennies"),
+    (Decimal("0.005"), "ant", "ants"),
+    (Decimal("0.0005"), "grain of sand", "grains of sand"),
+    (Decimal("0.00007"), "human hair", "human hairs"),
+    (Decimal("0.000007"), "red blood cell", "red blood cells")
+]
+
+re_length_part = re.compile(r"\s*(\d+(?:\.\d*)?|\.\d+)\s*([a-zµ\"'″′-]*)\s*", re.IGNORECASE)
+re_multiply = re.compile(r"^(?:[x*×]\s*(?P<pre>[\d.]+)|(?P<post>[\d.]+)\s*[x×])$", re.IGNORECASE)
+re_divide = re.compile(r"^/\s*(?P<amount>[\d.]+)$")
+re_percent = re.compile(r"^(?P<amount>[\d.]+)\s*%$")
+re_add = re.compile(r"^(?P<sign>[+-])\s*(?P<amount>.+)$")
+
+
+def _to_decimal(s: str) -> Decimal:
+    try:
+        return Decimal(s)
+    except InvalidOperation:
+        raise ParseError(f"{s!r} is not a valid number.")
+
+
+def _unit_size(unit: str) -> Decimal:
+    unit = unit.lower()
+    if unit in length_units:
+        return length_units[unit]
+    # Plurals: "feet" is covered above, but "meters", "miles", etc. aren't.
+    if unit.endswith("s") and unit[:-1] in length_units:
+        return length_units[unit[:-1]]
+    raise ParseError(f"{unit!r} is not a valid length unit.")
+
+
+def parse_length(s: str) -> Decimal:
+    """Parse a length string like "5ft7.5in", "5'7\"" or "175cm" into meters."""
+    s = s.strip()
+    if not s:
+        raise ParseError(f"{s!r} is not a valid unit string.")
+    total = Decimal(0)
+    pos = 0
+    last_size = None
+    while pos < len(s):
+        match = re_length_part.match(s, pos)
+        if match is None or match.end() == pos:
+            raise ParseError(f"{s!r} is not a valid unit string.")
+        amount, unit = match.groups()
+        if unit:
+            size = _unit_size(unit)
+        elif last_size == FOOT and match.end() == len(s):
+            # 5'7 means 5'7"
+            size = INCH
+        else:
+            raise ParseError(f"{s!r} has a number with no unit.")
+        total += _to_decimal(amount) * size
+        last_size = size
+        pos = match.end()
+    return total
+
+
+def parse_diff(s: str) -> AttrDict:
+    """Parse a change string like "2x", "/2", "50%" or "-6in" into a Diff."""
+    original = s
+    s = s.strip()
+    if (match := re_multiply.match(s)):
+        amount = _to_decimal(match.group("pre") or match.group("post"))
+        changetype = "multiply"
+    elif (match := re_divide.match(s)):
+        divisor = _to_decimal(match.group("amount"))
+        if divisor == 0:
+            raise ParseError(f"{original!r} divides by zero.")
+        amount = 1 / divisor
+        changetype = "multiply"
+    elif (match := re_percent.match(s)):
+        amount = _to_decimal(match.group("amount")) / 100
+        changetype = "multiply"
+    elif (match := re_add.match(s)):
+        amount = parse_length(match.group("amount"))
+        if match.group("sign") == "-":
+            amount = -amount
+        changetype = "add"
+    else:
+        raise ParseError(f"{original!r} is not a valid Diff.")
+    return AttrDict({"changetype": changetype, "amount": amount, "original": original})
+
+
+def _trim(value: Decimal, places: int = 2) -> str:
+    """Round a Decimal and drop any trailing zeroes."""
+    rounded = round(value, places)
+    text = f"{rounded:f}"
+    if "." in text:
+        text = text.rstrip("0").rstrip(".")
+    return text
+
+
+def _format_metric(value: Decimal) -> str:
+    for size, symbol in metric_display:
+        if value >= size:
+            return f"{_trim(value / size)}{symbol}"
+    size, symbol = metric_display[-1]
+    return f"{_trim(value / size, 3)}{symbol}"
+
+
+def _format_us(value: Decimal) -> str:
+    if value >= MILE:
+        return f"{_trim(value / MILE)}mi"
+    if value >= FOOT:
+        inches = round(value / INCH, 1)
+        feet, inches = divmod(inches, 12)
+        return f"{int(feet)}'{_trim(inches, 1)}\""
+    if value >= INCH / 100:
+        return f"{_trim(value / INCH)}in"
+    return f"{_trim(value / INCH, 6)}in"
+
+
+def _format_objects(value: Decimal) -> str:
+    for size, singular, plural in objects_display:
+        if value >= size:
+            break
+    amount = _trim(value / size, 1)
+    return f"{amount} {singular if amount == '1' else plural}"
+
+
+def format_length(value, system: str = "m") -> str:
+    """Format a length in meters using the metric ("m"), US ("u") or objects ("o") system."""
+    value = value if isinstance(value, Decimal) else _to_decimal(str(value))
+    if value < 0:
+        return "-" + format_length(-value, system)
+    if system == "m":
+        return _format_metric(value)
+    if system == "u":
+        return _format_us(value)
+    if system == "o":
+        return _format_objects(value)
+    raise ParseError(f"{system!r} is not a valid unit system.")
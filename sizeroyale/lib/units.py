@@ -1,21 +1,318 @@
-from typing import Union
+import atexit
+import json
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, Union
 import logging
 import requests
 from decimal import Decimal
 import urllib3
 from urllib.parse import quote
 
+from requests.adapters import HTTPAdapter
 from requests.models import HTTPError
 
+from sizeroyale.lib import unitengine
 from sizeroyale.lib.attrdict import AttrDict
+from sizeroyale.lib.cachedir import cache_dir
 from sizeroyale.lib.errors import ParseError
 
 logger = logging.getLogger("sizeroyale")
 urllib3.disable_warnings()
 
+
+def _encode(t: str, value) -> Union[str, dict]:
+    """Turn a parsed unit into something JSON can store."""
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, AttrDict):
+        return {k: str(v) if isinstance(v, Decimal) else v for k, v in value._values.items()}
+    return value
+
+
+def _decode(t: str, raw) -> Union[Decimal, AttrDict, dict]:
+    """Turn a stored unit back into what UnitWrapper.parse() returns."""
+    if t in ["SV", "WV", "TV"]:
+        return Decimal(raw)
+    if t == "Diff":
+        return AttrDict({**raw, "amount": Decimal(str(raw["amount"]))})
+    return raw
+
+
+class LocalBackend:
+    """Parses and formats units in-process, with no network access."""
+    name = "local"
+    # Results are cheap to make again and change with the engine, so they aren't saved to disk.
+    persistent = False
+
+    def parse(self, t: str, s: str) -> Union[Decimal, AttrDict, dict]:
+        if t == "SV":
+            return unitengine.parse_length(s)
+        if t == "Diff":
+            return unitengine.parse_diff(s)
+        raise ValueError(f"Parsing type {t} not supported by the local unit engine.")
+
+    def parse_many(self, t: str, strings: Iterable[str]) -> Dict[str, Union[Decimal, AttrDict, dict]]:
+        results = {}
+        for s in strings:
+            try:
+                results[s] = self.parse(t, s)
+            except ParseError:
+                pass
+        return results
+
+    def format(self, t: str, s: str, system: str = "m") -> str:
+        if t == "SV":
+            return unitengine.format_length(s, system)
+        raise ValueError(f"Formatting type {t} not supported by the local unit engine.")
+
+    def format_many(self, t: str, strings: Iterable[str], system: str = "m") -> Dict[str, str]:
+        return {s: self.format(t, s, system) for s in strings}
+
+
+class RemoteBackend:
+    """Parses and formats units using the SizeBot API, over one pooled session."""
+    name = "remote"
+
+    def __init__(self, url: str = "http://sizebot.digiduncan.com", *, workers: int = 8, timeout: float = 10):
+        self.url = url
+        self.workers = workers
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections = 1, pool_maxsize = workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _get(self, path: str) -> dict:
+        try:
+            r = self.session.get(self.url + path, verify=False, timeout=self.timeout)
+        except requests.exceptions.SSLError as e:
+            logger.error("SSL Error: The SSL certificate has expired for Sizebot API.")
+            raise e
+        if r.status_code != 200:
+            raise HTTPError
+        return r.json()
+
+    def parse(self, t: str, s: str) -> Union[Decimal, AttrDict, dict]:
+        responsejson = self._get(f"/unit/{t}/parse?s=" + quote(s))
+        return _decode(t, responsejson[t])
+
+    def parse_many(self, t: str, strings: Iterable[str]) -> Dict[str, Union[Decimal, AttrDict, dict]]:
+        """The API has no batch endpoint, so this sends every request at once over the pooled session."""
+        strings = list(strings)
+
+        def try_parse(s):
+            try:
+                return self.parse(t, s)
+            except (HTTPError, requests.exceptions.RequestException):
+                return None
+
+        with ThreadPoolExecutor(max_workers = self.workers) as executor:
+            values = executor.map(try_parse, strings)
+            return {s: v for s, v in zip(strings, values) if v is not None}
+
+    def format(self, t: str, s: str, system: str = "m") -> str:
+        responsejson = self._get(f"/unit/{t}/format?value=" + quote(s) + "&system=" + quote(system))
+        return responsejson["formatted"]
+
+    def format_many(self, t: str, strings: Iterable[str], system: str = "m") -> Dict[str, str]:
+        strings = list(strings)
+        with ThreadPoolExecutor(max_workers = self.workers) as executor:
+            return dict(zip(strings, executor.map(lambda s: self.format(t, s, system), strings)))
+
+
+class RecordingBackend:
+    """Passes everything through to another backend, and saves every result to
+    a file that a PlaybackBackend can serve later without the original backend.
+    New results are added to whatever the file already has."""
+    name = "record"
+    # Anything served from a cache would never make it into the recording.
+    cacheable = False
+
+    def __init__(self, path, backend = None):
+        self.path = Path(path)
+        self.backend = RemoteBackend() if backend is None else backend
+        self.recording = {"parse": {}, "format": {}}
+        if self.path.exists():
+            with open(self.path) as f:
+                recorded = json.load(f)
+            for kind in self.recording:
+                self.recording[kind].update(recorded.get(kind, {}))
+
+    def parse(self, t: str, s: str) -> Union[Decimal, AttrDict, dict]:
+        value = self.backend.parse(t, s)
+        self.recording["parse"][f"{t}:{s}"] = _encode(t, value)
+        return value
+
+    def parse_many(self, t: str, strings: Iterable[str]) -> Dict[str, Union[Decimal, AttrDict, dict]]:
+        results = self.backend.parse_many(t, strings)
+        for s, value in results.items():
+            self.recording["parse"][f"{t}:{s}"] = _encode(t, value)
+        return results
+
+    def format(self, t: str, s: str, system: str = "m") -> str:
+        formatted = self.backend.format(t, s, system)
+        self.recording["format"][f"{t}:{s}:{system}"] = formatted
+        return formatted
+
+    def format_many(self, t: str, strings: Iterable[str], system: str = "m") -> Dict[str, str]:
+        results = self.backend.format_many(t, strings, system)
+        for s, formatted in results.items():
+            self.recording["format"][f"{t}:{s}:{system}"] = formatted
+        return results
+
+    def save(self):
+        tmp = self.path.with_suffix(".tmp")
+        with open(tmp, "w") as f:
+            json.dump(self.recording, f, indent = 1, ensure_ascii = False)
+        tmp.replace(self.path)
+
+
+class PlaybackBackend:
+    """Serves results saved by a RecordingBackend, and never touches the network."""
+    name = "playback"
+    # The recording already is a cache on disk.
+    persistent = False
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path) as f:
+            self.recording = json.load(f)
+
+    def parse(self, t: str, s: str) -> Union[Decimal, AttrDict, dict]:
+        try:
+            return _decode(t, self.recording["parse"][f"{t}:{s}"])
+        except KeyError:
+            raise ParseError(f"{s!r} was not recorded in {self.path}.")
+
+    def parse_many(self, t: str, strings: Iterable[str]) -> Dict[str, Union[Decimal, AttrDict, dict]]:
+        recorded = self.recording["parse"]
+        return {s: _decode(t, recorded[f"{t}:{s}"]) for s in strings if f"{t}:{s}" in recorded}
+
+    def format(self, t: str, s: str, system: str = "m") -> str:
+        try:
+            return self.recording["format"][f"{t}:{s}:{system}"]
+        except KeyError:
+            raise ParseError(f"{s!r} formatted as {system!r} was not recorded in {self.path}.")
+
+    def format_many(self, t: str, strings: Iterable[str], system: str = "m") -> Dict[str, str]:
+        return {s: self.format(t, s, system) for s in strings}
+
+
+class UnitCache:
+    """A bounded LRU cache of parsed units, which can be saved to disk between runs."""
+    version = 2
+
+    def __init__(self, path = None, maxsize: int = 4096):
+        self.path = None if path is None else Path(path)
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._dirty = False
+        self.load()
+
+    def get(self, key: str):
+        raw = self._entries.get(key)
+        if raw is not None:
+            self._entries.move_to_end(key)
+        return raw
+
+    def put(self, key: str, raw):
+        self._entries[key] = raw
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last = False)
+        self._dirty = True
+
+    def clear(self):
+        self._entries.clear()
+        self._dirty = True
+
+    def load(self):
+        if self.path is None or not self.path.exists():
+            return
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            logger.warning(f"Unit cache {self.path} is unreadable, starting fresh.")
+            return
+        if data.get("version") != self.version:
+            return
+        for key, raw in data["entries"][-self.maxsize:]:
+            self._entries[key] = raw
+
+    def save(self):
+        if self.path is None or not self._dirty:
+            return
+        tmp = self.path.with_suffix(".tmp")
+        with open(tmp, "w") as f:
+            json.dump({"version": self.version, "entries": list(self._entries.items())}, f, ensure_ascii = False)
+        tmp.replace(self.path)
+        self._dirty = False
+
+    def __len__(self):
+        return len(self._entries)
+
+
+backends = {
+    "local": LocalBackend,
+    "remote": RemoteBackend,
+    "record": RecordingBackend,
+    "playback": PlaybackBackend
+}
+
+default_backend = LocalBackend()
+cache = UnitCache(cache_dir() / "units.json")
+# Parsed units from backends that aren't persistent.
+memory_cache = UnitCache(maxsize = 4096)
+# Formatted strings are cheap to make locally and depend on the display system, so they stay in memory.
+format_cache = UnitCache(maxsize = 4096)
+
+
+def set_backend(backend, *args, **kwargs):
+    """Set the backend used by every UnitWrapper that doesn't have its own.
+    Accepts a backend instance, or one of the names in `backends`
+    along with any arguments for its constructor, e.g.:
+    set_backend("playback", "tests/units.json")"""
+    global default_backend
+    if isinstance(backend, str):
+        if backend not in backends:
+            raise ValueError(f"Unit backend {backend!r} not valid.")
+        backend = backends[backend](*args, **kwargs)
+    default_backend = backend
+
+
+def flush():
+    """Save the unit cache, and the current recording if there is one."""
+    cache.save()
+    if hasattr(default_backend, "save"):
+        default_backend.save()
+
+
+atexit.register(flush)
+
+
 class UnitWrapper:
-    def __init__(self, unit):
+    def __init__(self, unit, backend = None):
         self._unit = unit
+        self._backend = backend
+
+    @property
+    def backend(self):
+        return default_backend if self._backend is None else self._backend
+
+    def _key(self, s: str) -> str:
+        return f"{self.backend.name}:{self._unit}:{s}"
+
+    @property
+    def cacheable(self) -> bool:
+        """Whether results can come from the caches instead of the backend."""
+        return getattr(self.backend, "cacheable", True)
+
+    @property
+    def _cache(self) -> UnitCache:
+        return cache if getattr(self.backend, "persistent", True) else memory_cache
 
     def parse(self, s: str) -> Union[Decimal, AttrDict, dict]:
         t = self._unit
@@ -25,19 +322,40 @@ class UnitWrapper:
             raise ValueError(f"Parsing type {t} not valid.")
         if s is None:
             raise ParseError(f"{s} is not a valid unit string.")
-        try:
-            r = requests.get(f"http://sizebot.digiduncan.com/unit/{t}/parse?s=" + quote(s), verify=False)
-        except requests.exceptions.SSLError as e:
-            logger.error("SSL Error: The SSL certificate has expired for Sizebot API.")
-            raise e
-        if r.status_code != 200:
-            raise HTTPError
-        responsejson = r.json()
-        if t in ["SV", "WV", "TV"]:
-            return Decimal(responsejson[t])
-        if t == "Diff":
-            return AttrDict(responsejson[t])
-        return responsejson[t]
+        if not self.cacheable:
+            return self.backend.parse(t, s)
+        key = self._key(s)
+        raw = self._cache.get(key)
+        if raw is not None:
+            return _decode(t, raw)
+        value = self.backend.parse(t, s)
+        self._cache.put(key, _encode(t, value))
+        return value
+
+    def parse_many(self, strings: Iterable[str]) -> Dict[str, Union[Decimal, AttrDict, dict]]:
+        """Parse many unit strings at once, resolving only the distinct ones that
+        aren't cached yet, in one call to the backend.
+        Strings that don't parse are left out, so parse() can raise their errors later."""
+        t = self._unit
+        if t not in ["SV", "WV", "TV", "Diff", "Rate", "LimitedRate"]:
+            raise ValueError(f"Parsing type {t} not valid.")
+        if not self.cacheable:
+            return self.backend.parse_many(t, dict.fromkeys(strings))
+        unit_cache = self._cache
+        results = {}
+        missing = []
+        for s in dict.fromkeys(strings):
+            raw = unit_cache.get(self._key(s))
+            if raw is None:
+                missing.append(s)
+            else:
+                results[s] = _decode(t, raw)
+        if missing:
+            resolved = self.backend.parse_many(t, missing)
+            for s, value in resolved.items():
+                unit_cache.put(self._key(s), _encode(t, value))
+            results.update(resolved)
+        return results
 
     def format(self, s: str, system: str = "m") -> str:
         t = self._unit
@@ -46,15 +364,43 @@ class UnitWrapper:
         s = str(s)
         if t not in ["SV", "WV", "TV"]:
             raise ValueError(f"Formatting type {t} not valid.")
-        try:
-            r = requests.get(f"http://sizebot.digiduncan.com/unit/{t}/format?value=" + quote(s) + "&system=" + quote(system), verify=False)
-        except requests.exceptions.SSLError as e: 
-            logger.error("SSL Error: The SSL certificate has expired for Sizebot API.")
-            raise e
-        if r.status_code != 200:
-            raise HTTPError
-        responsejson = r.json()
-        return responsejson["formatted"]
+        if not self.cacheable:
+            return self.backend.format(t, s, system)
+        key = f"{self._key(s)}:{system}"
+        formatted = format_cache.get(key)
+        if formatted is None:
+            formatted = self.backend.format(t, s, system)
+            format_cache.put(key, formatted)
+        return formatted
+
+    def format_many(self, values: Iterable, system: str = "m") -> List[str]:
+        """Format many values at once, in the same order they were given.
+        Only the distinct values that aren't cached yet are sent to the backend, in one call."""
+        t = self._unit
+        if t not in ["SV", "WV", "TV"]:
+            raise ValueError(f"Formatting type {t} not valid.")
+        strings = []
+        for v in values:
+            if v is None:
+                raise ParseError(f"{v} is not a valid unit string.")
+            strings.append(str(v))
+        if not self.cacheable:
+            results = self.backend.format_many(t, dict.fromkeys(strings), system)
+            return [results[s] for s in strings]
+        results = {}
+        missing = []
+        for s in dict.fromkeys(strings):
+            formatted = format_cache.get(f"{self._key(s)}:{system}")
+            if formatted is None:
+                missing.append(s)
+            else:
+                results[s] = formatted
+        if missing:
+            resolved = self.backend.format_many(t, missing, system)
+            for s, formatted in resolved.items():
+                format_cache.put(f"{self._key(s)}:{system}", formatted)
+            results.update(resolved)
+        return [results[s] for s in strings]
 
 
 SV = UnitWrapper("SV")
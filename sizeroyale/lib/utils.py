@@ -209,9 +209,10 @@ def findOne(iterator):
 
 
 def isURL(value) -> bool:
-    """Returns True when given either a valid URL, or `None`."""
+    """Returns True when given either a valid URL, or `None`.
+    Local addresses are allowed, so specs can point at a local server."""
     try:
-        return validator_collection.url(value)
+        return validator_collection.url(value, allow_special_ips = True)
     except validator_collection.errors.EmptyValueError:
         # Pretend None is a valid URL.
         return True
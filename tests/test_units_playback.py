@@ -0,0 +1,48 @@
+"""
+Parse the example spec with units served from tests/units.json, with no unit backend behind it.
+The recording was made with RecordingBackend, by parsing sizeroyale/data/royale-spec.txt
+and formatting each player's starting height in US units.
+"""
+
+from decimal import Decimal
+from pathlib import Path
+
+import pytest
+
+from sizeroyale.lib import units
+from sizeroyale.lib.classes.parser import Parser
+from sizeroyale.lib.errors import ParseError
+from sizeroyale.lib.units import SV
+
+here = Path(__file__).parent
+spec_file = here.parent / "sizeroyale" / "data" / "royale-spec.txt"
+
+
+@pytest.fixture
+def playback():
+    previous = units.default_backend
+    units.set_backend("playback", here / "units.json")
+    yield
+    units.set_backend(previous)
+
+
+def test_parse_spec(playback):
+    with open(spec_file) as f:
+        parser = Parser(None, f)
+    assert parser.errors == []
+    assert {n: p.height for n, p in parser.players.items()} == {
+        "DigiDuncan": Decimal("1.71450"),
+        "Lady": Decimal("1.8034"),
+        "Cool Dude": Decimal("1.7526"),
+        "Interesting Chick": Decimal("1.6002"),
+        "Amazing Person": Decimal("1.8796"),
+        "The Other One": Decimal("2")
+    }
+    assert SV.format_many([p.height for p in parser.players.values()], "u") == [
+        "5'7.5\"", "5'11\"", "5'9\"", "5'3\"", "6'2\"", "6'6.7\""
+    ]
+
+
+def test_unrecorded(playback):
+    with pytest.raises(ParseError, match = "not recorded"):
+        SV.parse("12 parsecs")